@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Query tool for time buckets saved by log analyzer with BUCKET_MINUTES
+Prints urls with max time_sum in a time range of a day, or per-bucket
+rows of a single url, without reading the log. Top urls get
+max_bucket_p99, the largest p99 of their buckets in the range, not p99 of
+the range
+python -m dz1.log_analyzer.bucket_query --date 2017.06.30 \
+    --start 14:00 --end 15:00 --top 20
+"""
+
+import argparse
+import datetime
+import sys
+
+from dz1.log_analyzer.fs_utils import load_external_config, query_buckets
+
+config = {
+    "REPORT_DIR": "./output"
+    }
+
+parser = argparse.ArgumentParser(
+    prog='BucketQuery',
+    description='Queries time buckets of analyzed logs')
+parser.add_argument('-c', '--config')
+parser.add_argument('-d', '--date', required=True, help='YYYY.MM.DD')
+parser.add_argument('-s', '--start', default='00:00', help='HH:MM')
+parser.add_argument('-e', '--end', default='24:00',
+                    help='HH:MM, not included')
+parser.add_argument('-t', '--top', type=int, default=10,
+                    help='Number of urls with max time_sum')
+parser.add_argument('-u', '--url', help='Print every bucket of this url')
+
+
+def parse_minute_of_day(value: str) -> int:
+    """
+    Method converts HH:MM to minutes since midnight
+    :param value: Time as HH:MM
+    :return: Minutes since midnight
+    """
+    hours, minutes = value.split(':')
+    return int(hours) * 60 + int(minutes)
+
+
+def format_minute(minute: int) -> str:
+    """
+    Method converts minutes since midnight to HH:MM
+    :param minute: Minutes since midnight
+    :return: Time as HH:MM
+    """
+    return f'{minute // 60:02d}:{minute % 60:02d}'
+
+
+def main():
+    """
+    Main query method - prints selected bucket rows as a table
+    :return: None
+    """
+    args = parser.parse_args()
+    if args.config:
+        load_external_config(args, config)
+    date = datetime.datetime.strptime(args.date, '%Y.%m.%d').date()
+    try:
+        rows = query_buckets(config, date,
+                             (parse_minute_of_day(args.start),
+                              parse_minute_of_day(args.end)),
+                             args.top, args.url)
+    except FileNotFoundError as exception:
+        sys.exit(str(exception))
+
+    if rows:
+        print('\t'.join(rows[0]))
+    for row in rows:
+        if 'minute' in row:
+            row['minute'] = format_minute(row['minute'])
+        print('\t'.join(f'{value:.3f}' if isinstance(value, float)
+                        else str(value) for value in row.values()))
+
+
+if __name__ == "__main__":
+    main()
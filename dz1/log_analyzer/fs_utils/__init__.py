@@ -6,3 +6,16 @@ from .fs_utils import load_external_config
 from .fs_utils import check_for_logs
 from .fs_utils import check_for_reports
 from .fs_utils import create_and_copy_report
+from .fs_utils import get_log_path
+from .fs_utils import log_fingerprint
+from .fs_utils import load_checkpoint
+from .fs_utils import save_checkpoint
+from .fs_utils import check_for_new_bytes
+from .fs_utils import save_day_aggregate
+from .fs_utils import load_day_aggregate
+from .fs_utils import check_for_aggregates
+from .fs_utils import save_buckets
+from .fs_utils import query_buckets
+from .time_index import build_time_index
+from .time_index import load_time_index
+from .time_index import read_time_range
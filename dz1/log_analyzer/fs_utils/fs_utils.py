@@ -1,18 +1,27 @@
 # -*- coding: utf-8 -*-
-# pylint:disable=broad-except
+# pylint:disable=broad-except,import-outside-toplevel
 
 """
 Module designed to work with filesystem for log analyzer
 """
 
+import functools
+import gzip
 import json
 import os
+import pickle
 import shutil
+import zlib
 from argparse import Namespace
+from typing import Iterable
 
-from datetime import datetime
+from datetime import date as date_type, datetime
 
 from dz1.log_analyzer.log import logger
+from dz1.log_analyzer.metrics import timed
+
+HEAD_SIZE = 4096
+REPORT_CHUNK_ROWS = 1000
 
 
 def load_external_config(args: Namespace, config: dict) -> dict:
@@ -32,6 +41,20 @@ def load_external_config(args: Namespace, config: dict) -> dict:
     return config
 
 
+def get_log_path(config: dict, file: str) -> str:
+    """
+    Method builds full path to log file from LOG_DIR
+    :param config: Dictionary containing config data from main script
+    :param file: Log file name
+    :return: Path to log file
+    """
+    if 'Otus2023/Otus2023' in os.getcwd():
+        return f'{os.getcwd()}/dz1/log_analyzer/' \
+               f'{config["LOG_DIR"].replace("./", "")}/{file}'
+    return f'{os.getcwd()}' + f'/{config["LOG_DIR"]}/{file}'
+
+
+@timed('check_for_logs')
 def check_for_logs(config: dict) -> dict or None:
     """
     Method for reading log files from directory, specified in config
@@ -57,6 +80,7 @@ def check_for_logs(config: dict) -> dict or None:
     return log_files
 
 
+@timed('check_for_reports')
 def check_for_reports(config: dict) -> dict or None:
     """
         Method for checking report files from directory, specified in config
@@ -79,25 +103,327 @@ def check_for_reports(config: dict) -> dict or None:
     return report_files
 
 
+@functools.lru_cache(maxsize=4)
+def _report_template(path: str, mtime: float) -> tuple:
+    """
+    Method reads report template once per modification time and splits it
+    around $table_json and $table_chunks placeholders
+    :param path: Path to report.html template
+    :param mtime: Modification time of template, part of cache key
+    :return: Tuple of template parts, the last one is None if template has
+    no $table_chunks
+    """
+    del mtime
+    with open(path, encoding='utf-8') as file:
+        head, rest = file.read().split('$table_json', 1)
+    if '$table_chunks' not in rest:
+        return head, rest, None
+    return (head,) + tuple(rest.split('$table_chunks', 1))
+
+
+def _write_chunks(directory: str, rows: list, chunk_rows: int) -> list:
+    """
+    Method writes rows as gzip compressed JSON files of chunk_rows rows
+    :param directory: Directory for chunk files, recreated
+    :param rows: Report rows
+    :param chunk_rows: Number of rows in chunk
+    :return: List of chunk file names relative to REPORT_DIR
+    """
+    shutil.rmtree(directory, ignore_errors=True)
+    if not rows:
+        return []
+    os.makedirs(directory)
+    names = []
+    for number, start in enumerate(range(0, len(rows), chunk_rows), 1):
+        name = f'{os.path.basename(directory)}/{number:05d}.json.gz'
+        with open(f'{directory}/{number:05d}.json.gz', 'wb') as chunk_file:
+            chunk_file.write(gzip.compress(
+                json.dumps(rows[start:start + chunk_rows]).encode('utf-8'),
+                compresslevel=6))
+        names.append(name)
+    return names
+
+
+def _script_json(value) -> str:
+    """
+    Method serializes value to JSON that is safe inside inline script,
+    every < is escaped, so urls from log can not close the script tag
+    :param value: JSON serializable value
+    :return: JSON string
+    """
+    return json.dumps(value).replace('<', '\\u003c')
+
+
+@timed('create_and_copy_report')
 def create_and_copy_report(filename: str,
                            config: dict,
                            first_k: list) -> None:
     """
     Method that takes sample report.html, modifies it with new data
     and saves to report folder with data when it was analyzed
+    First REPORT_CHUNK_ROWS rows are written into report as JSON, the rest
+    go to gzip compressed JSON chunks in chunks-<filename> folder that the
+    page loads on scroll, template is read once and report is written in
+    one pass
     :param filename: Name based on pattern 'report-YYY-MM-DD.html'
     :param config: Dictionary containing config data from main script
     :param first_k: list of Lines of logs, that report_creator produced
     :return: None
     """
-    shutil.copy(f'{os.getcwd()}/jquery/report.html',
-                f'{os.getcwd()}/{config["REPORT_DIR"]}/{filename}.html')
+    template = f'{os.getcwd()}/jquery/report.html'
+    head, middle, tail = _report_template(template,
+                                          os.path.getmtime(template))
+    report_dir = f'{os.getcwd()}/{config["REPORT_DIR"]}'
+    chunk_rows = config.get('REPORT_CHUNK_ROWS', REPORT_CHUNK_ROWS)
+    inline, chunks = first_k, []
+    if tail is not None:
+        inline = first_k[:chunk_rows]
+        chunks = _write_chunks(f'{report_dir}/chunks-{filename}',
+                               first_k[chunk_rows:], chunk_rows)
 
-    with open(f'{os.getcwd()}/{config["REPORT_DIR"]}/{filename}.html',
-              'r',
+    with open(f'{report_dir}/.{filename}.html.tmp', 'w',
               encoding='utf-8') as file:
-        file_data = file.read()
-    file_data = file_data.replace('$table_json', str(first_k))
-    with open(f'{os.getcwd()}/{config["REPORT_DIR"]}/{filename}.html',
-              'w', encoding='utf-8') as file:
-        file.write(file_data)
+        file.write(head)
+        file.write(_script_json(inline))
+        file.write(middle)
+        if tail is not None:
+            file.write(_script_json(chunks))
+            file.write(tail)
+    os.replace(f'{report_dir}/.{filename}.html.tmp',
+               f'{report_dir}/{filename}.html')
+
+
+def log_fingerprint(file_path: str, head_size: int = HEAD_SIZE) -> dict:
+    """
+    Method identifies log file by inode, size and checksum of its head,
+    so rotated or rewritten file is not mistaken for a grown one
+    :param file_path: Path to log file
+    :param head_size: Number of first bytes to checksum
+    :return: Dictionary with inode, size, head_size and head_crc
+    """
+    stat = os.stat(file_path)
+    with open(file_path, 'rb') as file:
+        head = file.read(min(head_size, stat.st_size))
+    return {'inode': stat.st_ino,
+            'size': stat.st_size,
+            'head_size': len(head),
+            'head_crc': zlib.crc32(head)}
+
+
+def _checkpoint_path(config: dict, file: str) -> str:
+    """
+    Method builds path to checkpoint of log file, checkpoint names
+    do not start with 'report-', so check_for_reports skips them
+    :param config: Dictionary containing config data from main script
+    :param file: Log file name
+    :return: Path to checkpoint file in REPORT_DIR
+    """
+    return f'{config["REPORT_DIR"]}/.checkpoint-{file}.pickle'
+
+
+def load_checkpoint(config: dict, file: str) -> dict or None:
+    """
+    Method loads checkpoint of log file if it still matches the file:
+    same inode, same head and file did not shrink
+    :param config: Dictionary containing config data from main script
+    :param file: Log file name
+    :return: Checkpoint dictionary, None if absent or outdated
+    """
+    try:
+        with open(_checkpoint_path(config, file), 'rb') as checkpoint_file:
+            checkpoint = pickle.load(checkpoint_file)
+    except FileNotFoundError:
+        return None
+    except (Exception,) as exception:
+        logger.exception('Exception on loading checkpoint: %s', exception)
+        return None
+
+    fingerprint = log_fingerprint(get_log_path(config, file),
+                                  checkpoint['head_size'])
+    if fingerprint['inode'] != checkpoint['inode'] \
+            or fingerprint['head_crc'] != checkpoint['head_crc'] \
+            or fingerprint['size'] < checkpoint['offset']:
+        logger.info('Checkpoint for %s is outdated', file)
+        return None
+    return checkpoint
+
+
+def save_checkpoint(config: dict, file: str, checkpoint: dict) -> None:
+    """
+    Method atomically saves checkpoint of log file to REPORT_DIR
+    :param config: Dictionary containing config data from main script
+    :param file: Log file name
+    :param checkpoint: Dictionary with fingerprint, offset and aggregate
+    :return: None
+    """
+    path = _checkpoint_path(config, file)
+    with open(f'{path}.tmp', 'wb') as checkpoint_file:
+        pickle.dump(checkpoint, checkpoint_file,
+                    protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(f'{path}.tmp', path)
+
+
+def check_for_new_bytes(config: dict, file: str) -> bool:
+    """
+    Method checks if log file got new bytes since last checkpoint
+    :param config: Dictionary containing config data from main script
+    :param file: Log file name
+    :return: False if checkpoint covers whole file, True otherwise
+    """
+    checkpoint = load_checkpoint(config, file)
+    if checkpoint is None:
+        return True
+    return os.path.getsize(get_log_path(config, file)) != checkpoint['size']
+
+
+def _aggregate_path(config: dict, date: date_type) -> str:
+    """
+    Method builds path to stored aggregate of log date, names do not start
+    with 'report-', so check_for_reports skips them
+    :param config: Dictionary containing config data from main script
+    :param date: Date of analyzed log
+    :return: Path to aggregate file in REPORT_DIR
+    """
+    return f'{config["REPORT_DIR"]}/.aggregate-{date:%Y.%m.%d}.pickle.gz'
+
+
+def save_day_aggregate(config: dict, date: date_type,
+                       aggregate: dict) -> None:
+    """
+    Method atomically saves per-url aggregate of log date to REPORT_DIR as
+    gzip compressed pickle, so multi-day reports can be built without
+    parsing logs again
+    :param config: Dictionary containing config data from main script
+    :param date: Date of analyzed log
+    :param aggregate: Aggregate with per-url results and totals
+    :return: None
+    """
+    path = _aggregate_path(config, date)
+    with gzip.open(f'{path}.tmp', 'wb', compresslevel=6) as aggregate_file:
+        pickle.dump(aggregate, aggregate_file,
+                    protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(f'{path}.tmp', path)
+
+
+def load_day_aggregate(config: dict, date: date_type) -> dict or None:
+    """
+    Method loads stored aggregate of log date
+    :param config: Dictionary containing config data from main script
+    :param date: Date of analyzed log
+    :return: Aggregate dictionary, None if absent or broken
+    """
+    try:
+        with gzip.open(_aggregate_path(config, date), 'rb') as aggregate_file:
+            return pickle.load(aggregate_file)
+    except FileNotFoundError:
+        return None
+    except (Exception,) as exception:
+        logger.exception('Exception on loading aggregate: %s', exception)
+        return None
+
+
+def check_for_aggregates(config: dict) -> dict or None:
+    """
+    Method for checking stored aggregates in REPORT_DIR
+    :param config: Dictionary containing config data from main script
+    :return: Dictionary of aggregate files by date, None if bad path
+    """
+    try:
+        files = os.listdir(config['REPORT_DIR'])
+    except (Exception,) as exception:
+        logger.exception('Exception on listing report dir: %s', exception)
+        return None
+
+    aggregate_files = {}
+    for file in files:
+        if not file.startswith('.aggregate-') \
+                or not file.endswith('.pickle.gz'):
+            continue
+        file_date = datetime.strptime(file.split('-')[1][:10],
+                                      '%Y.%m.%d').date()
+        aggregate_files[file_date] = file
+    return aggregate_files
+
+
+def _buckets_path(config: dict, date: date_type) -> str:
+    """
+    Method builds path to time bucket database of log date
+    :param config: Dictionary containing config data from main script
+    :param date: Date of analyzed log
+    :return: Path to sqlite file in REPORT_DIR
+    """
+    return f'{config["REPORT_DIR"]}/buckets-{date:%Y.%m.%d}.sqlite'
+
+
+def save_buckets(config: dict, date: date_type, rows: Iterable[tuple]) -> None:
+    """
+    Method atomically saves per-url time bucket rows of log date to sqlite
+    database indexed by bucket and by url
+    :param config: Dictionary containing config data from main script
+    :param date: Date of analyzed log
+    :param rows: (minute, url, count, time_sum, time_max, time_med,
+    time_p99) tuples from bucket_rows
+    :return: None
+    """
+    import sqlite3
+    path = _buckets_path(config, date)
+    if os.path.exists(f'{path}.tmp'):
+        os.remove(f'{path}.tmp')
+    connection = sqlite3.connect(f'{path}.tmp')
+    try:
+        with connection:
+            connection.execute('CREATE TABLE buckets (minute INTEGER, '
+                               'url TEXT, count INTEGER, time_sum REAL, '
+                               'time_max REAL, time_med REAL, '
+                               'time_p99 REAL)')
+            connection.executemany('INSERT INTO buckets '
+                                   'VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+            connection.execute('CREATE INDEX buckets_minute '
+                               'ON buckets (minute, time_sum)')
+            connection.execute('CREATE INDEX buckets_url '
+                               'ON buckets (url, minute)')
+    finally:
+        connection.close()
+    os.replace(f'{path}.tmp', path)
+
+
+def query_buckets(config: dict, date: date_type, minutes: tuple,
+                  limit: int = 10, url: str = None) -> list:
+    """
+    Method selects urls with max time_sum in [start, end) minutes of day,
+    or rows of every bucket of a single url
+    Top urls get max_bucket_p99, the largest time_p99 of their buckets,
+    p99 of the whole range can not be computed from bucket rows
+    :param config: Dictionary containing config data from main script
+    :param date: Date of analyzed log
+    :param minutes: Tuple of first minute of day and minute of day after
+    the range end
+    :param limit: Number of urls to select
+    :param url: Url to select buckets of, top urls if None
+    :return: List of row dictionaries
+    """
+    import sqlite3
+    start, end = minutes
+    path = _buckets_path(config, date)
+    if not os.path.exists(path):
+        raise FileNotFoundError(f'No time buckets for {date}')
+    connection = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+    connection.row_factory = sqlite3.Row
+    try:
+        if url is None:
+            rows = connection.execute(
+                'SELECT url, SUM(count) AS count, SUM(time_sum) AS time_sum, '
+                'MAX(time_max) AS time_max, '
+                'MAX(time_p99) AS max_bucket_p99 '
+                'FROM buckets WHERE minute >= ? AND minute < ? '
+                'GROUP BY url ORDER BY time_sum DESC LIMIT ?',
+                (start, end, limit))
+        else:
+            rows = connection.execute(
+                'SELECT minute, count, time_sum, time_max, time_med, '
+                'time_p99 FROM buckets '
+                'WHERE url = ? AND minute >= ? AND minute < ? ORDER BY minute',
+                (url, start, end))
+        return [dict(row) for row in rows]
+    finally:
+        connection.close()
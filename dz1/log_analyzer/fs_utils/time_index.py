@@ -0,0 +1,298 @@
+# -*- coding: utf-8 -*-
+# pylint:disable=broad-except
+
+"""
+Time index of raw logs for fs_utils
+For every minute of $time_local the index keeps position of the first line
+of that minute: byte offset for plain logs, and for gzip logs offset of the
+gzip member the line is in together with number of decompressed bytes from
+that member start. Lines of a time range are then read from the nearest
+indexed position instead of scanning the whole log
+Index is saved to REPORT_DIR/.timeindex-<log name>.json with log
+fingerprint and is rebuilt when log changes
+"""
+
+import bisect
+import gzip
+import json
+import os
+import zlib
+from datetime import datetime
+from typing import BinaryIO, Iterator, List, Optional
+
+from dz1.log_analyzer.fs_utils.fs_utils import get_log_path, log_fingerprint
+from dz1.log_analyzer.log import logger
+
+INDEX_BLOCK_SIZE = 1024 * 1024
+MONTHS = {month.encode(): number for number, month in enumerate(
+    ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct',
+     'Nov', 'Dec'), 1)}
+EPOCH = datetime(1970, 1, 1)
+
+
+def to_minute(moment: datetime) -> int:
+    """
+    Method converts naive local time to index minute
+    :param moment: Time as written in $time_local, without timezone
+    :return: Minutes since 1970-01-01 00:00
+    """
+    return int((moment.replace(tzinfo=None) - EPOCH).total_seconds() // 60)
+
+
+def line_minute(line: bytes) -> Optional[int]:
+    """
+    Method extracts index minute from $time_local of log line
+    :param line: Single log line
+    :return: Minutes since 1970-01-01 00:00, None if time is not found
+    """
+    # [29/Jun/2017:03:50:22 +0300]
+    start = line.find(b'[')
+    stamp = line[start + 1:start + 18]
+    if start == -1 or len(stamp) != 17 or stamp[11:12] != b':':
+        return None
+    try:
+        return to_minute(datetime(int(stamp[7:11]), MONTHS[stamp[3:6]],
+                                  int(stamp[:2]), int(stamp[12:14]),
+                                  int(stamp[15:17])))
+    except (KeyError, ValueError):
+        return None
+
+
+def _iter_gzip_chunks(file_path: str, members: list,
+                      starts: list) -> Iterator[bytes]:
+    """
+    Generator of decompressed data of every member of gzip file, compressed
+    offset of every member is appended to members and its decompressed
+    offset to starts
+    :param file_path: Path to gzip log file
+    :param members: List that receives compressed offsets of members
+    :param starts: List that receives decompressed offsets of members
+    :return: Iterator of decompressed chunks
+    """
+    with open(file_path, 'rb') as log_file:
+        compressed = decompressed = 0
+        decompressor = None
+        data = log_file.read(INDEX_BLOCK_SIZE)
+        while data:
+            if decompressor is None:
+                members.append(compressed)
+                starts.append(decompressed)
+                decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+            chunk = decompressor.decompress(data)
+            decompressed += len(chunk)
+            yield chunk
+            if decompressor.eof:
+                unused = decompressor.unused_data
+                compressed += len(data) - len(unused)
+                decompressor = None
+                data = unused or log_file.read(INDEX_BLOCK_SIZE)
+            else:
+                compressed += len(data)
+                data = log_file.read(INDEX_BLOCK_SIZE)
+
+
+def _iter_plain_chunks(file_path: str) -> Iterator[bytes]:
+    """
+    Generator of blocks of plain log file
+    :param file_path: Path to plain log file
+    :return: Iterator of bytes blocks
+    """
+    with open(file_path, 'rb') as log_file:
+        yield from iter(lambda: log_file.read(INDEX_BLOCK_SIZE), b'')
+
+
+def _iter_offset_lines(chunks: Iterator[bytes]) -> Iterator[tuple]:
+    """
+    Generator of complete lines of chunks with their offsets
+    :param chunks: Iterator of consecutive blocks of uncompressed log
+    :return: Iterator of (offset in uncompressed log, line) tuples
+    """
+    position, tail = 0, b''
+    for chunk in chunks:
+        block = tail + chunk
+        line_start = 0
+        newline = block.find(b'\n')
+        while newline != -1:
+            yield position + line_start, block[line_start:newline]
+            line_start = newline + 1
+            newline = block.find(b'\n', line_start)
+        position += line_start
+        tail = block[line_start:]
+
+
+def _gzip_entry(offset: int, members: list, starts: list) -> tuple:
+    """
+    Method finds gzip member that uncompressed offset is in
+    :param offset: Offset in uncompressed log
+    :param members: Compressed offsets of members
+    :param starts: Uncompressed offsets of members
+    :return: Index entry (offset, member offset, offset from member start)
+    """
+    number = bisect.bisect_right(starts, offset) - 1
+    return offset, members[number], offset - starts[number]
+
+
+def build_time_index(file_path: str) -> dict:
+    """
+    Method scans log once and records position of the first line of every
+    minute later than all previous lines, so slightly unordered lines do
+    not break binary search
+    :param file_path: Path to plain or gzip log file
+    :return: Dictionary with minutes and entries lists, entry is
+    (offset in uncompressed log, member offset, offset from member start)
+    """
+    members, starts = [], []
+    compressed = file_path.endswith('.gz')
+    chunks = _iter_gzip_chunks(file_path, members, starts) if compressed \
+        else _iter_plain_chunks(file_path)
+    minutes, entries = [], []
+    last_minute, last_stamp = None, None
+    for offset, line in _iter_offset_lines(chunks):
+        stamp = line[line.find(b'['):][:18]
+        if stamp == last_stamp:
+            continue
+        last_stamp = stamp
+        minute = line_minute(line)
+        if minute is not None \
+                and (last_minute is None or minute > last_minute):
+            last_minute = minute
+            minutes.append(minute)
+            entries.append(_gzip_entry(offset, members, starts) if compressed
+                           else (offset, 0, 0))
+    return {'minutes': minutes, 'entries': entries}
+
+
+def _time_index_path(config: dict, file: str) -> str:
+    """
+    Method builds path to time index of log file
+    :param config: Dictionary containing config data from main script
+    :param file: Log file name
+    :return: Path to index file in REPORT_DIR
+    """
+    return f'{config["REPORT_DIR"]}/.timeindex-{file}.json'
+
+
+def load_time_index(config: dict, file: str) -> dict:
+    """
+    Method loads time index of log file, index is built and saved if it is
+    absent or log changed since it was built
+    :param config: Dictionary containing config data from main script
+    :param file: Log file name
+    :return: Dictionary with minutes and entries lists
+    """
+    path = _time_index_path(config, file)
+    file_path = get_log_path(config, file)
+    fingerprint = log_fingerprint(file_path)
+    try:
+        with open(path, encoding='utf-8') as index_file:
+            index = json.load(index_file)
+        if index['fingerprint'] == fingerprint:
+            return index
+    except FileNotFoundError:
+        pass
+    except (Exception,) as exception:
+        logger.exception('Exception on loading time index: %s', exception)
+
+    logger.info('Building time index of %s', file)
+    index = build_time_index(file_path)
+    index['fingerprint'] = fingerprint
+    with open(f'{path}.tmp', 'w', encoding='utf-8') as index_file:
+        json.dump(index, index_file)
+    os.replace(f'{path}.tmp', path)
+    return index
+
+
+def _iter_range_blocks(log_file: BinaryIO,
+                       size: Optional[int]) -> Iterator[List[bytes]]:
+    """
+    Generator of lists of lines of next size bytes of file
+    :param log_file: File object opened in binary mode
+    :param size: Number of bytes to read, up to end of file if None
+    :return: Iterator of lists of bytes lines
+    """
+    tail = b''
+    while size is None or size > 0:
+        block = log_file.read(INDEX_BLOCK_SIZE if size is None
+                              else min(INDEX_BLOCK_SIZE, size))
+        if not block:
+            break
+        if size is not None:
+            size -= len(block)
+        block = tail + block
+        newline = block.rfind(b'\n')
+        tail = block[newline + 1:]
+        if newline != -1:
+            yield block[:newline].split(b'\n')
+    if tail:
+        yield [tail]
+
+
+def _range_position(index: dict, first: int, last: int) -> tuple:
+    """
+    Method finds indexed position of the minute before first and number
+    of bytes up to indexed position of the minute after last
+    :param index: Time index from load_time_index
+    :param first: First index minute of range
+    :param last: Index minute after the range end
+    :return: Tuple of index entry and size, size is None up to end of log
+    """
+    minutes, entries = index['minutes'], index['entries']
+    # One minute of slack on both sides for lines written out of order
+    begin = bisect.bisect_left(minutes, first) - 1
+    stop = bisect.bisect_right(minutes, last)
+    entry = entries[begin] if begin >= 0 else (0, 0, 0)
+    size = entries[stop][0] - entry[0] if stop < len(entries) else None
+    return entry, size
+
+
+def _select_minutes(blocks: Iterator[List[bytes]], first: int,
+                    last: int) -> Iterator[List[bytes]]:
+    """
+    Generator of lines of blocks with minute in [first, last), lines
+    without time are kept
+    :param blocks: Iterator of lists of bytes lines
+    :param first: First index minute of range
+    :param last: Index minute after the range end
+    :return: Iterator of non-empty lists of selected lines
+    """
+    last_stamp, minute = None, None
+    for lines in blocks:
+        selected = []
+        for line in lines:
+            stamp = line[line.find(b'['):][:18]
+            if stamp != last_stamp:
+                last_stamp, minute = stamp, line_minute(line)
+            if minute is None or first <= minute < last:
+                selected.append(line)
+        if selected:
+            yield selected
+
+
+def read_time_range(config: dict, file: str, start: datetime,
+                    end: datetime) -> Iterator[List[bytes]]:
+    """
+    Generator of lines of log with $time_local in [start, end) minutes,
+    read from indexed position of the minute before start up to indexed
+    position of the minute after end, lines without time are kept for
+    parser to count them as bad
+    :param config: Dictionary containing config data from main script
+    :param file: Log file name
+    :param start: First minute of range, naive local time of log
+    :param end: Minute after the range end, naive local time of log
+    :return: Iterator of lists of bytes lines, as read_log
+    """
+    first, last = to_minute(start), to_minute(end)
+    (offset, member, member_offset), size = _range_position(
+        load_time_index(config, file), first, last)
+
+    file_path = get_log_path(config, file)
+    with open(file_path, 'rb') as raw_file:
+        raw_file.seek(member if file_path.endswith('.gz') else offset)
+        log_file = raw_file
+        if file_path.endswith('.gz'):
+            log_file = gzip.GzipFile(fileobj=raw_file, mode='rb')
+            while member_offset > 0:
+                member_offset -= len(log_file.read(
+                    min(INDEX_BLOCK_SIZE, member_offset)))
+        yield from _select_minutes(_iter_range_blocks(log_file, size),
+                                   first, last)
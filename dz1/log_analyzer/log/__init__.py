@@ -2,35 +2,132 @@
 # pylint: disable=invalid-name
 """
 General logger
+Records are put to a queue by QueueHandler and written to console and
+rotating file by QueueListener thread, so parsing thread does no log I/O
+Handlers, log file and listener thread are created on the first record,
+so importing the logger does no I/O and a run that logs nothing never
+touches the log file
 """
 
 import logging
 import os
 import sys
-from logging.handlers import RotatingFileHandler
+import threading
 
 LOG_FILE_MAX_SIZE = 1024 * 1024 * 1024
 LOG_FILE_MAX_BACKUP_COUNT = 1
 
-try:
-    logger = logging.getLogger('common')
-    logger.setLevel(logging.DEBUG)
+logger = logging.getLogger('common')
+logger.setLevel(logging.DEBUG)
+
+handlers = []
+queue_handler = None
+listener = None
+_setup_lock = threading.Lock()
+
+
+def _create_handlers() -> list:
+    """
+    Method creates console handler and, if ./log directory exists,
+    rotating file handler
+    :return: List of handlers for listener
+    """
+    from logging.handlers import RotatingFileHandler  # pylint: disable=import-outside-toplevel
     formatter = logging.Formatter('[%(asctime)s] %(levelname).1s %(message)s',
                                   '%d.%m.%Y %H:%M:%S')
 
     console_handler = logging.StreamHandler(sys.stderr)
     console_handler.setLevel(logging.INFO)
     console_handler.setFormatter(formatter)
-    logger.addHandler(console_handler)
-
-    file_handler = RotatingFileHandler(
-        filename=f'{os.getcwd()}/log/autotest.log',
-        maxBytes=LOG_FILE_MAX_SIZE,
-        backupCount=LOG_FILE_MAX_BACKUP_COUNT,
-        encoding='utf-8',
-        mode='w')
-    file_handler.setLevel(logging.DEBUG)
-    file_handler.setFormatter(formatter)
-    logger.addHandler(file_handler)
-except FileNotFoundError:
-    print('No log directory found')
+    created = [console_handler]
+
+    try:
+        file_handler = RotatingFileHandler(
+            filename=f'{os.getcwd()}/log/autotest.log',
+            maxBytes=LOG_FILE_MAX_SIZE,
+            backupCount=LOG_FILE_MAX_BACKUP_COUNT,
+            encoding='utf-8',
+            mode='w')
+        file_handler.setLevel(logging.DEBUG)
+        file_handler.setFormatter(formatter)
+        created.append(file_handler)
+    except FileNotFoundError:
+        print('No log directory found')
+    return created
+
+
+def _start_listener() -> None:
+    """
+    Method starts listener thread on a new queue of queue_handler
+    :return: None
+    """
+    global listener  # pylint: disable=global-statement
+    # pylint: disable=import-outside-toplevel
+    import queue
+    from logging.handlers import QueueListener
+    queue_handler.queue = queue.SimpleQueue()
+    listener = QueueListener(queue_handler.queue, *handlers,
+                             respect_handler_level=True)
+    listener.start()
+
+
+def configure_logging() -> None:
+    """
+    Method replaces the lazy handler of logger with queue handler and
+    starts listener, repeated calls do nothing
+    :return: None
+    """
+    global queue_handler  # pylint: disable=global-statement
+    with _setup_lock:
+        if queue_handler is not None:
+            return
+        # pylint: disable=import-outside-toplevel
+        import atexit
+        from logging.handlers import QueueHandler
+        handlers.extend(_create_handlers())
+        queue_handler = QueueHandler(None)
+        _start_listener()
+        logger.addHandler(queue_handler)
+        logger.removeHandler(_lazy_handler)
+        atexit.register(_stop_listener)
+
+
+def _stop_listener() -> None:
+    """
+    Method flushes queued records and stops listener thread on exit
+    :return: None
+    """
+    if listener is not None:
+        listener.stop()
+
+
+class _LazyHandler(logging.Handler):
+    """
+    Handler that configures logging on the first record and passes
+    the record on to queue handler
+    """
+    def emit(self, record: logging.LogRecord) -> None:
+        configure_logging()
+        if queue_handler.filter(record):
+            queue_handler.handle(record)
+
+
+def _restart_listener() -> None:
+    """
+    Method starts a new listener thread in forked worker process, as threads
+    are not copied on fork, and stops it on multiprocessing exit, which
+    skips atexit handlers
+    :return: None
+    """
+    global _setup_lock  # pylint: disable=global-statement
+    _setup_lock = threading.Lock()
+    if queue_handler is None:
+        return
+    from multiprocessing.util import Finalize  # pylint: disable=import-outside-toplevel
+    _start_listener()
+    Finalize(listener, listener.stop, exitpriority=100)
+
+
+_lazy_handler = _LazyHandler()
+logger.addHandler(_lazy_handler)
+os.register_at_fork(after_in_child=_restart_listener)
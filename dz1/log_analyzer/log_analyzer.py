@@ -5,24 +5,37 @@
 #                     '$status $body_bytes_sent "$http_referer" '
 #                     '"$http_user_agent" "$http_x_forwarded_for"
 #                     '"$http_X_REQUEST_ID" "$http_X_RB_USER" $request_time';
+# pylint:disable=import-outside-toplevel
 
 """
 Main log analyzer module for translateing nginx logs into tabled html reports
 using jquery.tablesorter.min.js
 Runs fs-utils to work with files
 Runs report_creator to generate reports based on config
+report_creator and process pool are imported by functions that produce
+reports, so a run that finds no new logs only lists directories
 """
 
 import argparse
 import datetime
+import os
+import resource
 import signal
 import sys
+import time
 
 from dz1.log_analyzer.fs_utils import (load_external_config,
+                                       check_for_aggregates,
                                        check_for_logs,
-                                       check_for_reports, create_and_copy_report)
+                                       check_for_new_bytes,
+                                       check_for_reports, create_and_copy_report,
+                                       get_log_path,
+                                       load_checkpoint,
+                                       log_fingerprint,
+                                       save_checkpoint)
 from dz1.log_analyzer.log import logger
-from dz1.log_analyzer.report_creator import create_report
+from dz1.log_analyzer.metrics import reset_metrics, write_metrics, \
+    write_prometheus
 
 config = {
     "REPORT_SIZE": 1000,
@@ -35,6 +48,16 @@ parser = argparse.ArgumentParser(
     description='Translates logs to html table',
     epilog='Some help text')
 parser.add_argument('-c', '--config')
+parser.add_argument('-w', '--workers', type=int,
+                    help='Number of processes to analyze log with')
+parser.add_argument('-b', '--backfill', action='store_true',
+                    help='Analyze every log that has no report yet')
+parser.add_argument('-r', '--rollup', choices=('week', 'month'),
+                    help='Build report of stored aggregates of a period')
+parser.add_argument('--watch', action='store_true',
+                    help='Follow the latest log and update its report')
+parser.add_argument('-d', '--date',
+                    help='YYYY.MM.DD inside rollup period, latest if absent')
 
 
 def signal_handler(signum, frame):
@@ -48,6 +71,255 @@ def signal_handler(signum, frame):
     sys.exit(1)
 
 
+def report_filename(date: datetime.date) -> str:
+    """
+    Method builds report name for log date
+    :param date: Date of analyzed log
+    :return: Name based on pattern 'report-YYYY.MM.DD'
+    """
+    return 'report-' + f'{date.year}.' \
+                       f'{date.month:02d}.' \
+                       f'{date.day:02d}'
+
+
+def analyze_log(job_config: dict, date: datetime.date, log_file: str) -> str:
+    """
+    Method creates report for a single log file
+    :param job_config: Dictionary containing config data from main script
+    :param date: Date of log file
+    :param log_file: Log file name
+    :return: Name of created report
+    """
+    from dz1.log_analyzer.report_creator import create_report
+    first_k = []
+    try:
+        first_k = create_report(job_config, log_file, date)
+    except (FileNotFoundError,) as exception:
+        logger.exception('Unknown error %s', exception)
+
+    filename = report_filename(date)
+    create_and_copy_report(filename, job_config, first_k)
+    write_run_metrics(job_config, filename, log_file)
+    return filename
+
+
+def write_run_metrics(job_config: dict, filename: str, log_file: str) -> None:
+    """
+    Method writes metrics of the run to REPORT_DIR next to the report as
+    'metrics-YYYY.MM.DD.json' and, if config has PROMETHEUS_TEXTFILE,
+    to that file in Prometheus textfile format
+    :param job_config: Dictionary containing config data from main script
+    :param filename: Report name based on pattern 'report-YYYY.MM.DD'
+    :param log_file: Analyzed log file name
+    :return: None
+    """
+    labels = {'log': log_file, 'report': filename}
+    write_metrics(f'{os.getcwd()}/{job_config["REPORT_DIR"]}/'
+                  f'{filename.replace("report-", "metrics-")}.json', labels)
+    if job_config.get('PROMETHEUS_TEXTFILE'):
+        write_prometheus(job_config['PROMETHEUS_TEXTFILE'], labels)
+
+
+def _limit_memory(megabytes: int) -> None:
+    """
+    Backfill pool initializer that caps address space of a worker, so
+    a huge log fails its own job with MemoryError instead of OOM-killing
+    the whole box
+    :param megabytes: Memory limit of a worker, no limit if falsy
+    :return: None
+    """
+    if megabytes:
+        limit = megabytes * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+def _backfill_log(job: tuple) -> tuple:
+    """
+    Backfill pool job, creates report of a single log, any error of that
+    log is logged and the log is skipped
+    :param job: Tuple of job config, log date and log file name
+    :return: Tuple of log date and report name, None if report failed
+    """
+    job_config, date, log_file = job
+    try:
+        return date, analyze_log(job_config, date, log_file)
+    except (Exception,) as exception:  # pylint:disable=broad-except
+        logger.exception('Failed to backfill %s: %s', date, exception)
+        return date, None
+
+
+def backfill(job_config: dict, logs: dict, reports: dict) -> list:
+    """
+    Method creates reports for every log date that has no report yet
+    Logs are analyzed in a pool of BACKFILL_WORKERS processes, each one
+    limited to BACKFILL_WORKER_MEMORY_MB and replaced after every log,
+    and every report is written as soon as its log is analyzed
+    :param job_config: Dictionary containing config data from main script
+    :param logs: Dictionary of log files by date from check_for_logs
+    :param reports: Dictionary of report files by date from check_for_reports
+    :return: List of created report names
+    """
+    import multiprocessing
+    missing = sorted(set(logs) - set(reports))
+    logger.info('Backfilling %s logs', len(missing))
+    # Every log gets a single process, concurrency is capped by the pool
+    job_config = dict(job_config, WORKERS=1)
+    created = []
+    with multiprocessing.Pool(
+            processes=job_config.get('BACKFILL_WORKERS', 1),
+            initializer=_limit_memory,
+            initargs=(job_config.get('BACKFILL_WORKER_MEMORY_MB'),),
+            maxtasksperchild=1) as pool:
+        jobs = [(job_config, date, logs[date]) for date in missing]
+        for date, filename in pool.imap_unordered(_backfill_log, jobs):
+            if filename is not None:
+                created.append(filename)
+                logger.info('Report for %s is created', date)
+    return created
+
+
+def rollup_dates(period: str, date: datetime.date) -> list:
+    """
+    Method lists dates of ISO week or calendar month that contains date
+    :param period: 'week' or 'month'
+    :param date: Any date inside period
+    :return: List of dates of period
+    """
+    if period == 'week':
+        start = date - datetime.timedelta(days=date.weekday())
+        return [start + datetime.timedelta(days=day) for day in range(7)]
+    start = date.replace(day=1)
+    end = (start + datetime.timedelta(days=32)).replace(day=1)
+    return [start + datetime.timedelta(days=day)
+            for day in range((end - start).days)]
+
+
+def rollup(job_config: dict, period: str, date: datetime.date) -> str:
+    """
+    Method creates report of a week or month from stored per-day aggregates
+    :param job_config: Dictionary containing config data from main script
+    :param period: 'week' or 'month'
+    :param date: Any date inside period
+    :return: Name based on pattern 'rollup-<period>-YYYY.MM.DD' of the
+    first date of period
+    """
+    from dz1.log_analyzer.report_creator import create_rollup_report
+    dates = rollup_dates(period, date)
+    first_k = []
+    try:
+        first_k = create_rollup_report(job_config, dates)
+    except (FileNotFoundError,) as exception:
+        logger.exception('Unknown error %s', exception)
+
+    filename = f'rollup-{period}-{dates[0]:%Y.%m.%d}'
+    create_and_copy_report(filename, job_config, first_k)
+    return filename
+
+
+def render_watched(job_config: dict, date: datetime.date, log_file: str,
+                   aggregate: dict, offset: int) -> None:
+    """
+    Method writes report of followed log from its current aggregate and,
+    in INCREMENTAL mode, saves checkpoint so restart resumes from offset
+    :param job_config: Dictionary containing config data from main script
+    :param date: Date of followed log
+    :param log_file: Followed log file name
+    :param aggregate: Aggregate of lines read so far
+    :param offset: Number of bytes of log in aggregate
+    :return: None
+    """
+    from dz1.log_analyzer.report_creator import (BAD_LINES_THRESHOLD,
+                                                 build_first_k)
+    # Followed aggregate does not check bad lines while parsing, report and
+    # checkpoint get threshold of config
+    aggregate = dict(aggregate, bad_threshold=job_config.get(
+        'BAD_LINES_THRESHOLD', BAD_LINES_THRESHOLD))
+    try:
+        first_k = list(build_first_k(job_config, aggregate).values())
+    except (FileNotFoundError,) as exception:
+        logger.exception('Unknown error %s', exception)
+        return
+    create_and_copy_report(report_filename(date), job_config, first_k)
+    if job_config.get('INCREMENTAL'):
+        checkpoint = log_fingerprint(get_log_path(job_config, log_file))
+        checkpoint['offset'] = offset
+        checkpoint['aggregate'] = aggregate
+        save_checkpoint(job_config, log_file, checkpoint)
+
+
+def open_watched(job_config: dict, log_file: str) -> tuple:
+    """
+    Method starts following log file, from its checkpoint in INCREMENTAL
+    mode
+    :param job_config: Dictionary containing config data from main script
+    :param log_file: Log file name
+    :return: Tuple of LogTail and aggregate
+    """
+    from dz1.log_analyzer.report_creator import (checkpoint_matches, LogTail,
+                                                 new_aggregate)
+    aggregate, offset = new_aggregate(job_config), 0
+    if job_config.get('INCREMENTAL'):
+        checkpoint = load_checkpoint(job_config, log_file)
+        if checkpoint is not None and checkpoint_matches(job_config,
+                                                         checkpoint):
+            aggregate, offset = checkpoint['aggregate'], checkpoint['offset']
+    # Whole log is in one aggregate, share of bad lines is checked only by
+    # render_watched on a copy with threshold of config, and rows are never
+    # spilled
+    aggregate['bad_threshold'] = 1.0
+    aggregate['spill_urls'] = None
+    logger.info('Following %s from byte %s', log_file, offset)
+    return LogTail(get_log_path(job_config, log_file), offset), aggregate
+
+
+def watch(job_config: dict) -> None:
+    """
+    Method follows the latest plain log as it grows and re-renders its
+    report every WATCH_INTERVAL seconds if new lines were read, only new
+    lines are parsed into in-memory aggregate. When a log of a later date
+    appears, report of the previous one is finalized and the new one is
+    followed
+    :param job_config: Dictionary containing config data from main script
+    :return: None
+    """
+    from dz1.log_analyzer.report_creator import get_aggregator
+    interval = job_config.get('WATCH_INTERVAL', 60)
+    poll = job_config.get('WATCH_POLL', 1)
+    aggregator = get_aggregator(job_config)
+    date, log_file, tail, aggregate = None, None, None, None
+    rendered, changed = time.monotonic(), False
+    try:
+        while True:
+            logs = check_for_logs(job_config) or {}
+            plain = [log_date for log_date, file in logs.items()
+                     if not file.endswith('.gz')]
+            if plain and (date is None or max(plain) > date):
+                if tail is not None:
+                    aggregator(tail.read_blocks(), aggregate)
+                    render_watched(job_config, date, log_file, aggregate,
+                                   tail.offset)
+                    tail.close()
+                date = max(plain)
+                log_file = logs[date]
+                tail, aggregate = open_watched(job_config, log_file)
+                changed = True
+            if tail is not None:
+                lines = aggregate['lines']
+                aggregator(tail.read_blocks(), aggregate)
+                changed = changed or aggregate['lines'] != lines
+                if changed and time.monotonic() - rendered >= interval:
+                    render_watched(job_config, date, log_file, aggregate,
+                                   tail.offset)
+                    rendered, changed = time.monotonic(), False
+            time.sleep(poll)
+    finally:
+        if tail is not None:
+            if changed:
+                render_watched(job_config, date, log_file, aggregate,
+                               tail.offset)
+            tail.close()
+
+
 def main():
     """
     Main programm method - translates logs from nginx to reports using a
@@ -55,34 +327,47 @@ def main():
     :return: None
     """
     signal.signal(signal.SIGINT, signal_handler)
-    load_external_config(parser.parse_args(), config)
+    reset_metrics()
+    args = parser.parse_args()
+    load_external_config(args, config)
+    if args.workers:
+        config['WORKERS'] = args.workers
+
+    if args.watch:
+        signal.signal(signal.SIGTERM, signal_handler)
+        watch(config)
+        return
+
+    if args.rollup:
+        aggregates = check_for_aggregates(config)
+        if not aggregates:
+            sys.exit('No stored aggregates, run with PERSIST_AGGREGATES')
+        date = datetime.datetime.strptime(args.date, '%Y.%m.%d').date() \
+            if args.date else max(aggregates)
+        rollup(config, args.rollup, date)
+        return
 
     latest_logs = check_for_logs(config)
     if not latest_logs:
         sys.exit('No logs to analyze')
 
     latest_reports = check_for_reports(config)
-    if not latest_reports:
+    if latest_reports is None:
         sys.exit('Exception on loading reports dir')
 
-    if max(latest_reports) == max(latest_logs):
-        logger.info('Latest logs for %s are analyzed already', latest_reports)
-        sys.exit('No new logs to analyze')
-
-    first_k = []
-    try:
-        first_k = create_report(config, latest_logs[max(latest_logs)])
-    except (FileNotFoundError,) as exception:
-        logger.exception('Unknown error %s', exception)
+    if args.backfill:
+        backfill(config, latest_logs, latest_reports)
+        return
 
-    latest_date = datetime.datetime.strptime(
-                   latest_logs[max(latest_logs)].split('.')[1][4:],
-                   '%Y%m%d').date()
-    filename = 'report-' + f'{latest_date.year}.' \
-                           f'{latest_date.month:02d}.' \
-                           f'{latest_date.day:02d}'
+    if config.get('INCREMENTAL'):
+        if not check_for_new_bytes(config, latest_logs[max(latest_logs)]):
+            sys.exit(f'No new logs to analyze, latest log '
+                     f'{latest_logs[max(latest_logs)]} has no new lines')
+    elif latest_reports and max(latest_reports) == max(latest_logs):
+        sys.exit(f'No new logs to analyze, log of {max(latest_logs)} '
+                 f'is analyzed already')
 
-    create_and_copy_report(filename, config, first_k)
+    analyze_log(config, max(latest_logs), latest_logs[max(latest_logs)])
 
 
 if __name__ == "__main__":
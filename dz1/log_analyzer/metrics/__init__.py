@@ -0,0 +1,12 @@
+# -*- coding: utf-8 -*-
+"""
+General init file for metrics
+"""
+from .metrics import timed
+from .metrics import stage
+from .metrics import count_metric
+from .metrics import set_metric
+from .metrics import reset_metrics
+from .metrics import get_metrics
+from .metrics import write_metrics
+from .metrics import write_prometheus
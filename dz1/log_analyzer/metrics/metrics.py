@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+# pylint:disable=invalid-name
+
+"""
+Run metrics for log analyzer
+Collects stage timings and counters of a single run in process-wide
+registry and writes them as JSON file next to the report and, optionally,
+in Prometheus textfile format for node_exporter
+"""
+
+import functools
+import json
+import os
+import resource
+import time
+from contextlib import contextmanager
+
+_metrics = {'stages': {}, 'counters': {}}
+
+
+def reset_metrics() -> None:
+    """
+    Method clears registry before a new run
+    :return: None
+    """
+    _metrics['stages'] = {}
+    _metrics['counters'] = {}
+
+
+def add_stage_time(name: str, seconds: float) -> None:
+    """
+    Method adds time spent in stage, repeated stages are summed
+    :param name: Stage name
+    :param seconds: Time spent
+    :return: None
+    """
+    _metrics['stages'][name] = _metrics['stages'].get(name, 0.0) + seconds
+
+
+@contextmanager
+def stage(name: str):
+    """
+    Context manager that times code block as stage
+    :param name: Stage name
+    :return: None
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_stage_time(name, time.perf_counter() - started)
+
+
+def timed(name: str):
+    """
+    Decorator that times every call of function as stage
+    :param name: Stage name
+    :return: Decorator
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def count_metric(name: str, value: int = 1) -> None:
+    """
+    Method increments counter
+    :param name: Counter name
+    :param value: Increment
+    :return: None
+    """
+    _metrics['counters'][name] = _metrics['counters'].get(name, 0) + value
+
+
+def set_metric(name: str, value) -> None:
+    """
+    Method sets counter to value
+    :param name: Counter name
+    :param value: New value
+    :return: None
+    """
+    _metrics['counters'][name] = value
+
+
+def get_metrics() -> dict:
+    """
+    Method returns snapshot of registry with peak memory of this process
+    and its finished children
+    :return: Dictionary with stages, counters and peak_memory_mb
+    """
+    peak_kb = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                  resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    return {'stages': dict(_metrics['stages']),
+            'counters': dict(_metrics['counters']),
+            'peak_memory_mb': peak_kb / 1024}
+
+
+def _write_atomic(path: str, data: str) -> None:
+    """
+    Method writes file through temporary one, so readers never see
+    a partially written file
+    :param path: Path to file
+    :param data: File contents
+    :return: None
+    """
+    with open(f'{path}.tmp', 'w', encoding='utf-8') as file:
+        file.write(data)
+    os.replace(f'{path}.tmp', path)
+
+
+def write_metrics(path: str, labels: dict = None) -> dict:
+    """
+    Method writes metrics of current run as JSON
+    :param path: Path to JSON file
+    :param labels: Extra values to store with metrics, e.g. log name
+    :return: Written metrics
+    """
+    metrics = get_metrics()
+    metrics.update(labels or {})
+    _write_atomic(path, json.dumps(metrics, indent=2))
+    return metrics
+
+
+def write_prometheus(path: str, labels: dict = None) -> None:
+    """
+    Method writes metrics of current run in Prometheus textfile format
+    :param path: Path to .prom file in node_exporter textfile directory
+    :param labels: Labels added to every sample
+    :return: None
+    """
+    metrics = get_metrics()
+    label_text = ','.join(f'{key}="{value}"'
+                          for key, value in (labels or {}).items())
+    lines = ['# HELP log_analyzer_stage_seconds Time spent in stage',
+             '# TYPE log_analyzer_stage_seconds gauge']
+    for name, seconds in sorted(metrics['stages'].items()):
+        stage_labels = ','.join(filter(None, [label_text,
+                                              f'stage="{name}"']))
+        lines.append(f'log_analyzer_stage_seconds{{{stage_labels}}} '
+                     f'{seconds}')
+    counters = dict(metrics['counters'],
+                    peak_memory_mb=metrics['peak_memory_mb'])
+    for name, value in sorted(counters.items()):
+        lines.append(f'# TYPE log_analyzer_{name} gauge')
+        lines.append(f'log_analyzer_{name}{{{label_text}}} {value}')
+    _write_atomic(path, '\n'.join(lines) + '\n')
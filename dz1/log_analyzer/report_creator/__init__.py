@@ -3,3 +3,39 @@
 General init file for report_creator
 """
 from .report_creator import create_report
+from .report_creator import inner_create_report
+from .report_creator import validate_sample
+from .report_creator import create_rollup_report
+from .report_creator import create_range_report
+from .report_creator import checkpoint_matches
+from .aggregate import BAD_LINES_THRESHOLD
+from .aggregate import aggregate_blocks
+from .aggregate import aggregate_lines
+from .aggregate import bad_lines_exceeded
+from .aggregate import build_first_k
+from .aggregate import line_format
+from .aggregate import line_format_bytes
+from .aggregate import merge_aggregates
+from .aggregate import new_aggregate
+from .parallel import aggregate_parallel
+from .parallel import split_ranges
+from .tokenizer import parse_ui_short
+from .bad_lines import bad_line_category
+from .bad_lines import log_bad_lines_summary
+from .bad_lines import record_bad_line
+from .sketch import LogHistogram
+from .hll import HyperLogLog
+from .hll import client_hash
+from .reader import iter_gzip_raw_blocks
+from .reader import read_gzip
+from .reader import read_range
+from .reader import read_log
+from .reader import read_mmap
+from .reader import sample_lines
+from .reader import LogTail
+from .store import UrlStore
+from .spill import merge_spilled
+from .spill import spill
+from .normalizer import url_normalizer
+from .vectorized import aggregate_blocks_numpy
+from .vectorized import get_aggregator
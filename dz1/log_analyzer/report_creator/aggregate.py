@@ -0,0 +1,359 @@
+# -*- coding: utf-8 -*-
+# pylint:disable=anomalous-backslash-in-string
+
+"""
+Aggregation module for report_creator
+Turns log lines into per-url aggregates (count, time_sum, time_max and
+samples for median) kept in a columnar UrlStore, merges aggregates
+produced by different shards and builds the first_k dictionary the report
+expects
+If config has SKETCH_ACCURACY, samples are replaced with LogHistogram
+sketches and report also gets time_p90, time_p95 and time_p99 columns
+If config has URL_RULES, urls are normalized to route templates before
+aggregation
+Share of bad lines is checked after every block: parsing is aborted as soon
+as it is above BAD_LINES_THRESHOLD with BAD_LINES_CONFIDENCE, bad lines
+are counted by category and only first BAD_LINES_EXAMPLES of each are logged
+If config has BUCKET_MINUTES, urls are also aggregated per time bucket
+If config has SPILL_URLS, url rows are spilled to disk when there are more
+of them in memory
+If config has UNIQUE_CLIENTS_PRECISION, distinct remote_addr of every url
+are counted with HyperLogLog and report gets unique_clients column
+"""
+
+import itertools
+import math
+import re
+import statistics
+from typing import Callable, Iterable, Iterator
+
+from dz1.log_analyzer.log import logger
+from dz1.log_analyzer.report_creator.bad_lines import (BAD_LINES_EXAMPLES,
+                                                       log_bad_lines_summary,
+                                                       merge_bad_lines,
+                                                       record_bad_line)
+from dz1.log_analyzer.report_creator.buckets import (add_to_bucket,
+                                                     merge_buckets)
+from dz1.log_analyzer.report_creator.hll import client_hash
+from dz1.log_analyzer.report_creator.normalizer import (URL_CACHE_SIZE,
+                                                        url_normalizer)
+from dz1.log_analyzer.report_creator.spill import (SPILL_PARTITIONS,
+                                                   merge_spill_files,
+                                                   spill,
+                                                   spill_needed)
+from dz1.log_analyzer.report_creator.store import UrlStore
+from dz1.log_analyzer.report_creator.tokenizer import parse_ui_short
+
+line_format = re.compile(
+    '(?P<remote_addr>(?:^|\b(?<!\.))'
+    '(?:1?\d\d?|2[0-4]\d|25[0-5])(?:\.(?:1?\d\d?|2[0-4]\d|25[0-5])){3}'
+    '(?=$|[^\w.]))\s'
+    '(?P<useless_data>-|\S{0,30})\s{2}'
+    '(?P<remote_usr>-|[a-z_][a-z0-9_]{0,30})\s'
+    '(?P<date_time>\[(?P<date>[0-3][0-9]\/\w{3}\/[12]\d{3}):'
+    '(?P<time>\d\d:\d\d:\d\d).*\])\s(?P<request>\"'
+    '(?P<req_method>GET|POST|HEAD|PUT|DELETE|CONNECT|OPTIONS|TRACE|PATCH)\s'
+    '(?P<req_uri>\S*)\s(?P<http_ver>HTTP/\d\.\d)\")\s'
+    '(?P<status>\d{3})\s'
+    '(?P<body_byte_sent>\d+)\s\"'
+    '(?P<http_referer>[^\s]+)\"\s\"'
+    '(?P<user_agent>[^\"]+)\"\s\"'
+    '(?P<forward_for>[^\"]+)\"\s\"'
+    '(?P<x_req_id>-|\d{0,16}-\d{0,16}-\d{0,16}-\d{0,16})\"\s\"'
+    '(?P<x_rb_usr>\S{0,30})\"\s'
+    '(?P<req_time>\d.\d{0,10})')
+line_format_bytes = re.compile(line_format.pattern.encode('utf-8'))
+
+PERCENTILES = (90, 95, 99)
+LINES_BLOCK = 10000
+BAD_LINES_THRESHOLD = 0.5
+BAD_LINES_CONFIDENCE = 0.999
+
+
+def new_aggregate(config: dict = None) -> dict:
+    """
+    Method creates an empty aggregate
+    :param config: Dictionary containing config data from main script
+    :return: Dictionary with per-url results and totals
+    """
+    config = config or {}
+    confidence = config.get('BAD_LINES_CONFIDENCE', BAD_LINES_CONFIDENCE)
+    return {'results': UrlStore(config.get('SKETCH_ACCURACY'),
+                                config.get('UNIQUE_CLIENTS_PRECISION')),
+            'total_time': 0.0,
+            'lines': 0,
+            'bad_reqs': 0,
+            'slow_lines': 0,
+            'sketch_accuracy': config.get('SKETCH_ACCURACY'),
+            'url_rules': config.get('URL_RULES'),
+            'url_cache_size': config.get('URL_CACHE_SIZE', URL_CACHE_SIZE),
+            'bad_threshold': config.get('BAD_LINES_THRESHOLD',
+                                        BAD_LINES_THRESHOLD),
+            'bad_z': statistics.NormalDist().inv_cdf(confidence),
+            'bad_categories': {},
+            'bad_examples': {},
+            'bad_examples_limit': config.get('BAD_LINES_EXAMPLES',
+                                             BAD_LINES_EXAMPLES),
+            'bucket_minutes': config.get('BUCKET_MINUTES'),
+            'buckets': {} if config.get('BUCKET_MINUTES') else None,
+            # Checkpoint has to keep every row, so no spilling
+            'spill_urls': None if config.get('INCREMENTAL')
+            else config.get('SPILL_URLS'),
+            'spill_partitions': config.get('SPILL_PARTITIONS',
+                                           SPILL_PARTITIONS),
+            'spill_root': config.get('SPILL_DIR'),
+            'spill_dir': None,
+            'spill_files': {}}
+
+
+def bad_lines_exceeded(bad_reqs: int, lines: int,
+                       threshold: float, z_score: float) -> bool:
+    """
+    Method checks if share of bad lines is above threshold with given
+    confidence, using lower bound of Wilson score interval, so a few bad
+    lines at the start of a log do not abort it
+    :param bad_reqs: Number of bad lines
+    :param lines: Number of lines read
+    :param threshold: Allowed share of bad lines, 0..1
+    :param z_score: Standard score of required one-sided confidence
+    :return: True if bad share is above threshold
+    """
+    if not bad_reqs:
+        return False
+    ratio = bad_reqs / lines
+    centre = ratio + z_score ** 2 / (2 * lines)
+    margin = z_score * math.sqrt(ratio * (1 - ratio) / lines
+                                 + z_score ** 2 / (4 * lines ** 2))
+    return (centre - margin) / (1 + z_score ** 2 / lines) > threshold
+
+
+def check_bad_lines(aggregate: dict, bad_reqs: int, lines: int) -> None:
+    """
+    Method aborts parsing if share of bad lines is confidently above
+    threshold of aggregate, bad lines parsed so far are logged first
+    :param aggregate: Aggregate with bad_threshold and bad_z
+    :param bad_reqs: Number of bad lines
+    :param lines: Number of lines read
+    :return: None
+    """
+    threshold = aggregate.get('bad_threshold', BAD_LINES_THRESHOLD)
+    z_score = aggregate.get('bad_z', 3.0)
+    if bad_lines_exceeded(bad_reqs, lines, threshold, z_score):
+        log_bad_lines_summary(aggregate)
+        logger.error('More than %s of lines were not parsed, %s of %s bad',
+                     f'{threshold:.0%}', bad_reqs, lines)
+        raise FileNotFoundError(f'More than {threshold:.0%} of lines '
+                                f'were not parsed')
+
+
+def _parse_slow(aggregate: dict, line: bytes) -> tuple or None:
+    """
+    Method parses line rejected by ui_short tokenizer with line_format
+    regex and counts it in slow_lines
+    :param aggregate: Aggregate to update
+    :param line: Log line
+    :return: Tuple of raw req_uri and req_time, None for a bad line
+    """
+    aggregate['slow_lines'] += 1
+    data = line_format_bytes.search(line)
+    if data is None:
+        return None
+    return data.group('req_uri'), float(data.group('req_time'))
+
+
+def _intern_url(results: UrlStore, indexes: dict, raw_uri: bytes,
+                normalize: Callable, cache_size: int) -> int:
+    """
+    Method decodes and normalizes raw req_uri and caches its row index,
+    cache is cleared when it grows over cache_size entries
+    :param results: Store the url is counted in
+    :param indexes: Cache of raw req_uri to row index
+    :param raw_uri: Raw req_uri of line
+    :param normalize: Url normalizer, or None
+    :param cache_size: Max number of cached req_uri
+    :return: Row index of url
+    """
+    req_uri = raw_uri.decode('utf-8', 'replace')
+    if normalize:
+        req_uri = normalize(req_uri)
+    index = results.get_index(req_uri)
+    if len(indexes) >= cache_size:
+        indexes.clear()
+    indexes[raw_uri] = index
+    return index
+
+
+def _line_client_hash(client_hashes: dict, line: bytes,
+                      cache_size: int) -> int:
+    """
+    Method hashes remote_addr of line, hashes are cached as most requests
+    come from a few clients, cache is cleared when it grows over
+    cache_size entries
+    :param client_hashes: Cache of remote_addr to hash
+    :param line: Parsed log line
+    :param cache_size: Max number of cached hashes
+    :return: Hash of remote_addr
+    """
+    remote_addr = line[:line.find(b' ')]
+    value_hash = client_hashes.get(remote_addr)
+    if value_hash is None:
+        if len(client_hashes) >= cache_size:
+            client_hashes.clear()
+        value_hash = client_hashes[remote_addr] = client_hash(remote_addr)
+    return value_hash
+
+
+def parse_blocks(blocks: Iterable[Iterable[bytes]], aggregate: dict,
+                 before_spill: Callable = None) -> Iterator[tuple]:
+    """
+    Generator of parsed lines of blocks, shared by aggregation backends
+    Lines are parsed by ui_short tokenizer first, lines it rejects go to
+    line_format regex and are counted in slow_lines, bad lines are counted
+    and recorded. Clients and time bucket of a line are counted here too
+    After every block lines of aggregate are counted, share of bad lines is
+    checked and rows are spilled if needed
+    :param blocks: Iterable of lists of bytes lines
+    :param aggregate: Aggregate to update
+    :param before_spill: Called before rows are spilled, so that lines
+    buffered by caller get into the store first
+    :return: Iterator of (store, row index, req_time) of parsed lines
+    """
+    results = aggregate['results']
+    normalize = url_normalizer(aggregate['url_rules'])
+    cache_size = aggregate['url_cache_size']
+    bucketed = aggregate.get('bucket_minutes')
+    client_hashes = {} if results.client_precision else None
+    indexes = {}
+    for lines in blocks:
+        for line in lines:
+            parsed = parse_ui_short(line)
+            if parsed is None:
+                parsed = _parse_slow(aggregate, line)
+            if not parsed:
+                if b'"0" 400' not in line:
+                    aggregate['bad_reqs'] += 1
+                    record_bad_line(aggregate, line)
+                continue
+            raw_uri, req_time = parsed
+            index = indexes.get(raw_uri)
+            if index is None:
+                index = _intern_url(results, indexes, raw_uri, normalize,
+                                    cache_size)
+            if client_hashes is not None:
+                results.clients[index].add(
+                    _line_client_hash(client_hashes, line, cache_size))
+            if bucketed:
+                add_to_bucket(aggregate, line, results.urls[index], req_time)
+            yield results, index, req_time
+        aggregate['lines'] += len(lines)
+        check_bad_lines(aggregate, aggregate['bad_reqs'], aggregate['lines'])
+        if spill_needed(aggregate):
+            if before_spill is not None:
+                before_spill()
+            spill(aggregate)
+            results = aggregate['results']
+            indexes.clear()
+
+
+def aggregate_blocks(blocks: Iterable[Iterable[bytes]],
+                     aggregate: dict = None) -> dict:
+    """
+    Method parses blocks of bytes lines and adds them to aggregate
+    Url is decoded and normalized only once per distinct raw req_uri,
+    this cache is cleared when it grows over url_cache_size entries
+    :param blocks: Iterable of lists of bytes lines
+    :param aggregate: Aggregate to update, new one is created if None
+    :return: Aggregate with per-url results and totals
+    """
+    if aggregate is None:
+        aggregate = new_aggregate()
+    total_time = aggregate['total_time']
+    for results, index, req_time in parse_blocks(blocks, aggregate):
+        results.add(index, req_time)
+        total_time += req_time
+    aggregate['total_time'] = total_time
+    return aggregate
+
+
+def aggregate_lines(log_file: Iterable, aggregate: dict = None) -> dict:
+    """
+    Method parses lines and adds them to aggregate
+    :param log_file: Iterable of log file lines, str or bytes
+    :param aggregate: Aggregate to update, new one is created if None
+    :return: Aggregate with per-url results and totals
+    """
+    lines = (line.encode('utf-8') if isinstance(line, str) else line
+             for line in log_file)
+    return aggregate_blocks(
+        iter(lambda: list(itertools.islice(lines, LINES_BLOCK)), []),
+        aggregate)
+
+
+def parsed_lines(aggregate: dict) -> int:
+    """
+    Method counts lines of aggregate that were parsed into url rows
+    :param aggregate: Aggregate, possibly with results cut by merge_spilled
+    :return: Number of parsed lines
+    """
+    return aggregate.get('parsed_lines') or sum(aggregate['results'].count)
+
+
+def merge_aggregates(target: dict, other: dict) -> dict:
+    """
+    Method merges other aggregate into target one
+    :param target: Aggregate that receives data
+    :param other: Aggregate that is merged in, left untouched
+    :return: Target aggregate
+    """
+    if 'distinct_urls' in target or 'distinct_urls' in other:
+        # Results cut to report candidates can not count distinct urls of
+        # merged rows, sum is an upper bound if days share urls
+        target['distinct_urls'] = \
+            (target.get('distinct_urls') or len(target['results'])) \
+            + (other.get('distinct_urls') or len(other['results']))
+        target['parsed_lines'] = parsed_lines(target) + parsed_lines(other)
+    target['results'].merge(other['results'])
+    target['total_time'] += other['total_time']
+    target['lines'] += other['lines']
+    target['bad_reqs'] += other['bad_reqs']
+    target['slow_lines'] += other['slow_lines']
+    merge_buckets(target, other)
+    merge_spill_files(target, other)
+    return merge_bad_lines(target, other)
+
+
+def build_first_k(config: dict, aggregate: dict) -> dict:
+    """
+    Method selects REPORT_SIZE urls with max time_sum from aggregate
+    and calculates percentages and medians for them
+    :param config: Dictionary containing config data from main script
+    :param aggregate: Aggregate with per-url results and totals
+    :return: Dictionary of urls matching expression with max(time_max)
+    """
+    total_time = aggregate['total_time']
+    bad_reqs = aggregate['bad_reqs']
+    logger.info('%s lines were parsed by slow path regex',
+                aggregate['slow_lines'])
+    results = aggregate['results']
+    threshold = aggregate.get('bad_threshold', BAD_LINES_THRESHOLD)
+    if aggregate['lines'] and bad_reqs / aggregate['lines'] > threshold:
+        logger.error('More than %s of lines were not parsed',
+                     f'{threshold:.0%}')
+        raise FileNotFoundError(f'More than {threshold:.0%} of lines '
+                                f'were not parsed')
+
+    distinct_urls = aggregate.get('distinct_urls') or len(results)
+    first_k = {}
+    for index in results.top_k(config['REPORT_SIZE']):
+        row = results.row(index)
+        row['count_perc'] = row['count'] / distinct_urls * 100
+        row['time_perc'] = row['time_sum'] / total_time * 100
+        if results.sketch_accuracy:
+            sketch = results.samples[index]
+            row['time_med'] = sketch.quantile(0.5)
+            for percentile in PERCENTILES:
+                row[f'time_p{percentile}'] = sketch.quantile(percentile / 100)
+        else:
+            row['time_med'] = statistics.median(results.samples[index])
+        first_k[row['url']] = row
+    return first_k
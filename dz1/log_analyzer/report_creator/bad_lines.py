@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+
+"""
+Bad line accounting for report_creator
+Every unparsed line is counted by error category, only the first
+BAD_LINES_EXAMPLES lines of each category are kept as examples. Examples
+and summary of all categories are logged once log is parsed and shard
+aggregates are merged, so every logged example is counted once
+"""
+
+from dz1.log_analyzer.log import logger
+from dz1.log_analyzer.report_creator.tokenizer import (REQUEST_METHODS,
+                                                       UI_SHORT_QUOTES)
+
+BAD_LINES_EXAMPLES = 5
+EXAMPLE_MAX_LENGTH = 1000
+
+
+def bad_line_category(line: bytes) -> str:
+    """
+    Method guesses why line was not parsed, only called for bad lines
+    :param line: Single log line
+    :return: 'empty', 'truncated', 'quotes', 'request', 'req_time' or 'format'
+    """
+    if not line.strip():
+        return 'empty'
+    quotes = line.count(b'"')
+    if quotes < UI_SHORT_QUOTES:
+        return 'truncated'
+    if quotes > UI_SHORT_QUOTES:
+        return 'quotes'
+    request_start = line.find(b'"') + 1
+    request = line[request_start:line.find(b'"', request_start)].split(b' ')
+    if len(request) != 3 or request[0] not in REQUEST_METHODS:
+        return 'request'
+    req_time = line[line.rfind(b'"') + 1:].strip()
+    if not req_time[:1].isdigit():
+        return 'req_time'
+    return 'format'
+
+
+def record_bad_line(aggregate: dict, line: bytes) -> None:
+    """
+    Method counts bad line in its category of aggregate and keeps it as
+    example while category has less than bad_examples_limit examples
+    :param aggregate: Aggregate to update
+    :param line: Single log line that was not parsed
+    :return: None
+    """
+    category = bad_line_category(line)
+    categories = aggregate.setdefault('bad_categories', {})
+    categories[category] = categories.get(category, 0) + 1
+    examples = aggregate.setdefault('bad_examples', {}).setdefault(category,
+                                                                   [])
+    if len(examples) < aggregate.get('bad_examples_limit',
+                                     BAD_LINES_EXAMPLES):
+        example = line[:EXAMPLE_MAX_LENGTH].decode('utf-8', 'replace')
+        examples.append(example)
+
+
+def merge_bad_lines(target: dict, other: dict) -> dict:
+    """
+    Method merges bad line counters and examples of other aggregate
+    :param target: Aggregate that receives data
+    :param other: Aggregate that is merged in, left untouched
+    :return: Target aggregate
+    """
+    categories = target.setdefault('bad_categories', {})
+    for category, count in other.get('bad_categories', {}).items():
+        categories[category] = categories.get(category, 0) + count
+    limit = target.get('bad_examples_limit', BAD_LINES_EXAMPLES)
+    examples = target.setdefault('bad_examples', {})
+    for category, lines in other.get('bad_examples', {}).items():
+        kept = examples.setdefault(category, [])
+        kept.extend(lines[:max(0, limit - len(kept))])
+    return target
+
+
+def log_bad_lines_summary(aggregate: dict) -> None:
+    """
+    Method logs kept examples and number of bad lines per category and how
+    many of them were not logged
+    :param aggregate: Aggregate with bad_categories and bad_examples
+    :return: None
+    """
+    examples = aggregate.get('bad_examples', {})
+    for category, count in sorted(aggregate.get('bad_categories', {}).items(),
+                                  key=lambda item: -item[1]):
+        for example in examples.get(category, ()):
+            logger.warning('Bad line (%s) %s', category, example)
+        logger.warning('%s bad lines (%s), %s of them not logged',
+                       count, category,
+                       count - len(examples.get(category, ())))
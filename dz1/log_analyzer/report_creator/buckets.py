@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+
+"""
+Time-bucketed aggregation for report_creator
+If config has BUCKET_MINUTES, every parsed line is also counted in a
+UrlStore of its time_local bucket (minutes since midnight rounded down to
+BUCKET_MINUTES), bucket rows are stored per day to be queried without
+reading the log again
+"""
+
+import statistics
+from typing import Iterator
+
+from dz1.log_analyzer.report_creator.store import UrlStore
+from dz1.log_analyzer.report_creator.tokenizer import parse_minute
+
+
+def add_to_bucket(aggregate: dict, line: bytes, url: str,
+                  req_time: float) -> None:
+    """
+    Method counts request time of url in time bucket of line
+    :param aggregate: Aggregate with bucket_minutes and buckets
+    :param line: Parsed log line
+    :param url: Url the line was counted for
+    :param req_time: Request time
+    :return: None
+    """
+    minute = parse_minute(line)
+    if minute is None:
+        return
+    bucket = minute - minute % aggregate['bucket_minutes']
+    store = aggregate['buckets'].get(bucket)
+    if store is None:
+        store = aggregate['buckets'][bucket] = \
+            UrlStore(aggregate['sketch_accuracy'])
+    store.add(store.get_index(url), req_time)
+
+
+def merge_buckets(target: dict, other: dict) -> dict:
+    """
+    Method merges time buckets of other aggregate
+    :param target: Aggregate that receives data
+    :param other: Aggregate that is merged in, left untouched
+    :return: Target aggregate
+    """
+    buckets = target.get('buckets')
+    if buckets is None:
+        return target
+    for bucket, store in other.get('buckets', {}).items():
+        if bucket in buckets:
+            buckets[bucket].merge(store)
+        else:
+            buckets[bucket] = UrlStore(store.sketch_accuracy).merge(store)
+    return target
+
+
+def bucket_rows(aggregate: dict) -> Iterator[tuple]:
+    """
+    Generator of rows of every url in every time bucket
+    :param aggregate: Aggregate with buckets
+    :return: Iterator of (minute, url, count, time_sum, time_max, time_med,
+    time_p99) tuples
+    """
+    for bucket, store in sorted(aggregate.get('buckets', {}).items()):
+        for index, url in enumerate(store.urls):
+            samples = store.samples[index]
+            if store.sketch_accuracy:
+                time_med = samples.quantile(0.5)
+                time_p99 = samples.quantile(0.99)
+            else:
+                time_med = statistics.median(samples)
+                time_p99 = statistics.quantiles(samples, n=100,
+                                                method='inclusive')[98] \
+                    if len(samples) > 1 else samples[0]
+            yield (bucket, url, store.count[index], store.time_sum[index],
+                   store.time_max[index], time_med, time_p99)
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+
+"""
+Distinct count sketch module for report_creator
+HyperLogLog with 2 ** precision one-byte registers: memory per url is fixed
+and standard error of distinct count is about 1.04 / sqrt(2 ** precision).
+Values are hashed with blake2b, so sketches built in different processes
+and on different days can be merged
+"""
+
+import hashlib
+import math
+
+HASH_BITS = 64
+
+
+def client_hash(value: bytes) -> int:
+    """
+    Method hashes value to 64 bits the same way in every process
+    :param value: Value to count, e.g. remote_addr
+    :return: 64-bit hash
+    """
+    return int.from_bytes(hashlib.blake2b(value, digest_size=8).digest(),
+                          'big')
+
+
+class HyperLogLog:
+    """
+    Mergeable distinct count sketch
+    """
+    __slots__ = ('precision', 'registers')
+
+    def __init__(self, precision: int = 10):
+        """
+        :param precision: Number of index bits, 4 <= precision <= 18
+        """
+        if not 4 <= precision <= 18:
+            raise ValueError('HyperLogLog precision must be between 4 and 18')
+        self.precision = precision
+        self.registers = bytearray(1 << precision)
+
+    def __getstate__(self):
+        return self.precision, bytes(self.registers)
+
+    def __setstate__(self, state):
+        self.precision, registers = state
+        self.registers = bytearray(registers)
+
+    def add(self, value_hash: int) -> None:
+        """
+        Method counts hashed value
+        :param value_hash: 64-bit hash from client_hash
+        :return: None
+        """
+        bits = HASH_BITS - self.precision
+        index = value_hash >> bits
+        rank = bits - (value_hash & ((1 << bits) - 1)).bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other: 'HyperLogLog') -> 'HyperLogLog':
+        """
+        Method adds values of other sketch to this one
+        :param other: Sketch with the same precision
+        :return: This sketch
+        """
+        if other.precision != self.precision:
+            raise ValueError('Can not merge HyperLogLog with different '
+                             'precision')
+        self.registers = bytearray(map(max, self.registers, other.registers))
+        return self
+
+    def count(self) -> int:
+        """
+        Method estimates number of distinct values
+        :return: Estimated distinct count
+        """
+        size = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / size)
+        estimate = alpha * size * size / sum(
+            2.0 ** -register for register in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * size and zeros:
+            estimate = size * math.log(size / zeros)
+        return round(estimate)
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+
+"""
+Url normalizer module for report_creator
+Maps raw req_uri to a route template with URL_RULES from config, so urls
+that differ only by ids or query strings are aggregated as one route
+Rules are a list of [regex, replacement] pairs applied in order with re.sub
+"""
+
+import re
+from typing import Callable, List, Optional
+
+URL_CACHE_SIZE = 100000
+
+
+def url_normalizer(rules: List[List[str]]) -> Optional[Callable[[str], str]]:
+    """
+    Method compiles URL_RULES into a normalizer function
+    :param rules: List of [regex, replacement] pairs
+    :return: Function that maps raw url to route template, None if no rules
+    """
+    if not rules:
+        return None
+    compiled = [(re.compile(pattern), replacement)
+                for pattern, replacement in rules]
+
+    def normalize(url: str) -> str:
+        for pattern, replacement in compiled:
+            url = pattern.sub(replacement, url)
+        return url
+    return normalize
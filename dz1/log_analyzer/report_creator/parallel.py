@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+
+"""
+Parallel mode for report_creator
+Uncompressed logs are split into newline-aligned byte ranges, gzip logs
+are decompressed into chunks of lines. Each shard is aggregated in a
+process pool and shard aggregates are merged into one
+"""
+
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Iterator, List, Tuple
+
+from dz1.log_analyzer.report_creator.aggregate import (merge_aggregates,
+                                                       new_aggregate)
+from dz1.log_analyzer.report_creator.reader import (iter_gzip_raw_blocks,
+                                                    read_log,
+                                                    split_block)
+from dz1.log_analyzer.report_creator.vectorized import get_aggregator
+
+GZIP_CHUNK_SIZE = 16 * 1024 * 1024
+
+
+def split_ranges(file_path: str, shards: int,
+                 start: int = 0, end: int = None) -> List[Tuple[int, int]]:
+    """
+    Method splits file into byte ranges that start and end on line borders
+    :param file_path: Path to uncompressed log file
+    :param shards: Number of ranges to split file into
+    :param start: First byte to split from, must be a line start
+    :param end: Byte to split up to, file size if None
+    :return: List of (start, end) byte offsets, end is exclusive
+    """
+    if end is None:
+        end = os.path.getsize(file_path)
+    size = end - start
+    if size <= 0:
+        return []
+    shards = max(1, min(shards, size))
+    borders = [start]
+    with open(file_path, 'rb') as log_file:
+        for shard in range(1, shards):
+            log_file.seek(max(start + size * shard // shards, borders[-1]))
+            log_file.readline()
+            border = min(log_file.tell(), end)
+            if border > borders[-1]:
+                borders.append(border)
+    if borders[-1] != end:
+        borders.append(end)
+    return list(zip(borders[:-1], borders[1:]))
+
+
+def _aggregate_range(config: dict, file_path: str,
+                     start: int, end: int) -> dict:
+    """
+    Pool worker that aggregates single byte range of a file
+    :param config: Dictionary containing config data from main script
+    :param file_path: Path to uncompressed log file
+    :param start: First byte of range
+    :param end: Byte after the range end
+    :return: Aggregate of the range
+    """
+    return get_aggregator(config)(read_log(config, file_path, start, end),
+                                  new_aggregate(config))
+
+
+def _aggregate_chunk(config: dict, chunk: bytes) -> dict:
+    """
+    Pool worker that aggregates chunk of decompressed log
+    :param config: Dictionary containing config data from main script
+    :param chunk: Decompressed bytes that end on a line border
+    :return: Aggregate of the chunk
+    """
+    return get_aggregator(config)((split_block(chunk),),
+                                  new_aggregate(config))
+
+
+def _gzip_chunks(config: dict, file_path: str,
+                 chunk_size: int) -> Iterator[bytes]:
+    """
+    Generator of decompressed chunks of a gzip file, sent to workers as
+    single bytes objects, which is much cheaper to pickle than lines
+    :param config: Dictionary containing config data from main script
+    :param file_path: Path to gzip log file
+    :param chunk_size: Number of decompressed bytes in one chunk
+    :return: Iterator of bytes chunks that end on line borders
+    """
+    return iter_gzip_raw_blocks(file_path,
+                                config.get('GZIP_BACKEND', 'gzip'),
+                                chunk_size)
+
+
+def aggregate_parallel(config: dict, file_path: str, start: int = 0,
+                       end: int = None, aggregate: dict = None) -> dict:
+    """
+    Method aggregates log file in a pool of WORKERS processes
+    :param config: Dictionary containing config data from main script
+    :param file_path: Path to log file, plain or gzip
+    :param start: First byte of plain log to aggregate
+    :param end: Byte after the last one to aggregate, file size if None
+    :param aggregate: Aggregate to merge shards into, new one if None
+    :return: Merged aggregate of all shards
+    """
+    workers = config['WORKERS']
+    if aggregate is None:
+        aggregate = new_aggregate(config)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        if file_path.endswith('.gz'):
+            # Chunks are submitted through a bounded window, so decompressed
+            # data is never held in memory for the whole file
+            pending = deque()
+            for chunk in _gzip_chunks(config, file_path,
+                                      GZIP_CHUNK_SIZE):
+                pending.append(
+                    executor.submit(_aggregate_chunk, config, chunk))
+                if len(pending) >= workers * 2:
+                    merge_aggregates(aggregate, pending.popleft().result())
+            while pending:
+                merge_aggregates(aggregate, pending.popleft().result())
+        else:
+            # Shards are merged as they finish and dropped right after, so
+            # merged shard aggregates do not stay in memory
+            futures = {executor.submit(_aggregate_range, config, file_path,
+                                       shard_start, shard_end)
+                       for shard_start, shard_end
+                       in split_ranges(file_path, workers, start, end)}
+            for future in as_completed(futures):
+                futures.remove(future)
+                merge_aggregates(aggregate, future.result())
+    return aggregate
@@ -0,0 +1,419 @@
+# -*- coding: utf-8 -*-
+
+"""
+Reader module for report_creator
+Reads plain and gzip logs as binary in large blocks cut on line borders,
+so lines are handed to the parser as bytes without per-line readline
+and decode calls
+Uncompressed logs can also be memory-mapped, then only the requested byte
+range is mapped and blocks are cut on newlines found in the mapping
+Gzip logs are decompressed by GZIP_BACKEND: python gzip module in the
+parsing thread, a reader thread feeding a bounded queue, or an external
+zcat / pigz process, so decompression overlaps with parsing
+A prefix or random sample of lines can be read to validate log format
+before the full pass
+Growing plain log can be followed by LogTail, which reads only lines
+appended since the previous call and reopens the log when it is rotated
+"""
+
+import gzip
+import mmap
+import os
+import queue
+import random
+import subprocess
+import threading
+from typing import BinaryIO, Iterator, List
+
+from dz1.log_analyzer.metrics import count_metric
+
+BLOCK_SIZE = 1024 * 1024
+GZIP_QUEUE_SIZE = 8
+GZIP_COMMANDS = {'zcat': ['zcat'],
+                 'pigz': ['pigz', '-dc']}
+
+
+def iter_raw_blocks(log_file: BinaryIO, block_size: int = BLOCK_SIZE,
+                    size: int = None) -> Iterator[bytes]:
+    """
+    Generator of blocks that end on a line border, only the last one
+    may end without newline
+    :param log_file: File object opened in binary mode
+    :param block_size: Number of bytes read at once
+    :param size: Number of bytes to read, up to end of file if None
+    :return: Iterator of bytes blocks
+    """
+    tail = b''
+    while size is None or size > 0:
+        block = log_file.read(block_size if size is None
+                              else min(block_size, size))
+        if not block:
+            break
+        if size is not None:
+            size -= len(block)
+        newline = block.rfind(b'\n')
+        if newline == -1:
+            tail += block
+            continue
+        yield tail + block[:newline + 1]
+        tail = block[newline + 1:]
+    if tail:
+        yield tail
+
+
+def split_block(block: bytes) -> List[bytes]:
+    """
+    Method splits block into lines without newline characters
+    :param block: Bytes block from iter_raw_blocks
+    :return: List of bytes lines
+    """
+    lines = block.split(b'\n')
+    if not lines[-1]:
+        lines.pop()
+    return lines
+
+
+def iter_blocks(log_file: BinaryIO, block_size: int = BLOCK_SIZE,
+                size: int = None) -> Iterator[List[bytes]]:
+    """
+    Generator of lists of lines read block by block
+    :param log_file: File object opened in binary mode
+    :param block_size: Number of bytes read at once
+    :param size: Number of bytes to read, up to end of file if None
+    :return: Iterator of lists of bytes lines
+    """
+    for block in iter_raw_blocks(log_file, block_size, size):
+        yield split_block(block)
+
+
+def read_range(file_path: str, start: int = 0,
+               end: int = None) -> Iterator[List[bytes]]:
+    """
+    Generator of lines of uncompressed log in [start, end) byte range,
+    start must be a line start
+    :param file_path: Path to uncompressed log file
+    :param start: First byte of range
+    :param end: Byte after the range end, end of file if None
+    :return: Iterator of lists of bytes lines
+    """
+    with open(file_path, 'rb') as log_file:
+        log_file.seek(start)
+        yield from iter_blocks(log_file,
+                               size=None if end is None else end - start)
+
+
+def read_mmap(file_path: str, start: int = 0, end: int = None,
+              block_size: int = BLOCK_SIZE) -> Iterator[List[bytes]]:
+    """
+    Generator of lines of uncompressed log in [start, end) byte range read
+    through mmap, only this range of file is mapped, start must be a line
+    start
+    :param file_path: Path to uncompressed log file
+    :param start: First byte of range
+    :param end: Byte after the range end, end of file if None
+    :param block_size: Number of bytes split into lines at once
+    :return: Iterator of lists of bytes lines
+    """
+    with open(file_path, 'rb') as log_file:
+        size = os.fstat(log_file.fileno()).st_size
+        end = size if end is None else min(end, size)
+        if end <= start:
+            return
+        offset = start - start % mmap.ALLOCATIONGRANULARITY
+        with mmap.mmap(log_file.fileno(), end - offset,
+                       access=mmap.ACCESS_READ, offset=offset) as mapped:
+            if hasattr(mapped, 'madvise'):
+                mapped.madvise(mmap.MADV_SEQUENTIAL)
+            position, limit = start - offset, end - offset
+            while position < limit:
+                block_end = min(position + block_size, limit)
+                if block_end < limit:
+                    newline = mapped.rfind(b'\n', position, block_end)
+                    if newline == -1:
+                        newline = mapped.find(b'\n', block_end, limit)
+                    block_end = limit if newline == -1 else newline + 1
+                # Block is copied out of the mapping: tokenizer needs bytes
+                # methods and exported memoryviews would keep mmap open
+                yield split_block(mapped[position:block_end])
+                position = block_end
+
+
+def read_log(config: dict, file_path: str, start: int = 0,
+             end: int = None) -> Iterator[List[bytes]]:
+    """
+    Method picks reader for log file: gzip with GZIP_BACKEND, mmap if config
+    has MMAP or buffered blocks
+    :param config: Dictionary containing config data from main script
+    :param file_path: Path to log file
+    :param start: First byte of uncompressed log to read
+    :param end: Byte after the range end, end of file if None
+    :return: Iterator of lists of bytes lines
+    """
+    if file_path.endswith('.gz'):
+        return read_gzip(file_path, config.get('GZIP_BACKEND', 'gzip'))
+    if config.get('MMAP'):
+        return read_mmap(file_path, start, end)
+    return read_range(file_path, start, end)
+
+
+def sample_lines(config: dict, file_path: str, count: int,
+                 mode: str = 'prefix', seed: int = None) -> List[bytes]:
+    """
+    Method reads sample of log lines: first count lines, or lines at count
+    random offsets of uncompressed log, gzip logs are always sampled by
+    prefix as they can not be seeked
+    :param config: Dictionary containing config data from main script
+    :param file_path: Path to log file
+    :param count: Number of lines in sample
+    :param mode: 'prefix' or 'random'
+    :param seed: Seed of random offsets
+    :return: List of bytes lines
+    """
+    if mode == 'random' and not file_path.endswith('.gz'):
+        return _sample_random_lines(file_path, count, seed)
+    if mode not in ('prefix', 'random'):
+        raise ValueError(f'Unknown sample mode {mode}')
+    sample = []
+    blocks = read_log(config, file_path)
+    try:
+        for lines in blocks:
+            sample.extend(lines[:count - len(sample)])
+            if len(sample) >= count:
+                break
+    finally:
+        blocks.close()
+    return sample
+
+
+def _sample_random_lines(file_path: str, count: int,
+                         seed: int = None) -> List[bytes]:
+    """
+    Method reads the line after each of count random offsets, sorted so
+    file is read forward only
+    :param file_path: Path to uncompressed log file
+    :param count: Number of lines in sample
+    :param seed: Seed of random offsets
+    :return: List of bytes lines
+    """
+    size = os.path.getsize(file_path)
+    if not size:
+        return []
+    offsets = sorted(random.Random(seed).randrange(size)
+                     for _ in range(count))
+    sample = []
+    with open(file_path, 'rb') as log_file:
+        for offset in offsets:
+            log_file.seek(offset)
+            if offset:
+                log_file.readline()
+            line = log_file.readline().rstrip(b'\n')
+            if line:
+                sample.append(line)
+    return sample
+
+
+def iter_gzip_raw_blocks(file_path: str, backend: str = 'gzip',
+                         block_size: int = BLOCK_SIZE) -> Iterator[bytes]:
+    """
+    Generator of decompressed blocks of gzip log that end on line borders
+    :param file_path: Path to gzip log file
+    :param backend: 'gzip', 'thread', 'zcat' or 'pigz'
+    :param block_size: Number of decompressed bytes read at once
+    :return: Iterator of bytes blocks
+    """
+    if backend == 'gzip':
+        log_file = gzip.open(file_path, 'rb')
+        blocks = iter_raw_blocks(log_file, block_size)
+    elif backend == 'thread':
+        log_file = None
+        blocks = _iter_threaded_blocks(file_path, block_size)
+    elif backend in GZIP_COMMANDS:
+        log_file = None
+        blocks = _iter_process_blocks(GZIP_COMMANDS[backend] + [file_path],
+                                      block_size)
+    else:
+        raise ValueError(f'Unknown gzip backend {backend}')
+    try:
+        for block in blocks:
+            count_metric('bytes_decompressed', len(block))
+            yield block
+    finally:
+        blocks.close()
+        if log_file is not None:
+            log_file.close()
+
+
+def _iter_threaded_blocks(file_path: str,
+                          block_size: int) -> Iterator[bytes]:
+    """
+    Generator of blocks decompressed by a reader thread, zlib releases GIL
+    while inflating, so it runs in parallel with parsing of previous blocks
+    :param file_path: Path to gzip log file
+    :param block_size: Number of decompressed bytes read at once
+    :return: Iterator of bytes blocks
+    """
+    blocks = queue.Queue(maxsize=GZIP_QUEUE_SIZE)
+    stop = threading.Event()
+
+    def put(item) -> bool:
+        """
+        Puts item to queue unless consumer stopped, which may happen while
+        queue is full
+        :param item: Block, exception or None at the end
+        :return: False if consumer stopped
+        """
+        while not stop.is_set():
+            try:
+                blocks.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            with gzip.open(file_path, 'rb') as log_file:
+                for block in iter_raw_blocks(log_file, block_size):
+                    if not put(block):
+                        return
+        except (Exception,) as exception:  # pylint:disable=broad-except
+            put(exception)
+            return
+        put(None)
+
+    reader = threading.Thread(target=produce, daemon=True)
+    reader.start()
+    try:
+        while True:
+            block = blocks.get()
+            if block is None:
+                break
+            if isinstance(block, Exception):
+                raise block
+            yield block
+    finally:
+        stop.set()
+        reader.join()
+
+
+def _iter_process_blocks(command: List[str],
+                         block_size: int) -> Iterator[bytes]:
+    """
+    Generator of blocks decompressed by external process
+    :param command: Decompressor command line that writes to stdout
+    :param block_size: Number of decompressed bytes read at once
+    :return: Iterator of bytes blocks
+    """
+    with subprocess.Popen(command, stdout=subprocess.PIPE,
+                          bufsize=block_size) as process:
+        yield from iter_raw_blocks(process.stdout, block_size)
+        if process.wait() != 0:
+            raise OSError(f'{command[0]} exited with {process.returncode}')
+
+
+def read_gzip(file_path: str, backend: str = 'gzip') -> Iterator[List[bytes]]:
+    """
+    Generator of lines of gzip log
+    :param file_path: Path to gzip log file
+    :param backend: Decompression backend, see iter_gzip_raw_blocks
+    :return: Iterator of lists of bytes lines
+    """
+    for block in iter_gzip_raw_blocks(file_path, backend):
+        yield split_block(block)
+
+
+def find_lines_end(file_path: str, size: int,
+                   block_size: int = 65536) -> int:
+    """
+    Method finds end of the last complete line, so a line that is still
+    being written is left for the next run
+    :param file_path: Path to uncompressed log file
+    :param size: Number of bytes of file to look at
+    :param block_size: Number of bytes read backwards at once
+    :return: Byte after the last newline, 0 if there is no newline
+    """
+    with open(file_path, 'rb') as log_file:
+        position = size
+        while position > 0:
+            block_start = max(0, position - block_size)
+            log_file.seek(block_start)
+            newline = log_file.read(position - block_start).rfind(b'\n')
+            if newline != -1:
+                return block_start + newline + 1
+            position = block_start
+    return 0
+
+
+class LogTail:
+    """
+    Follower of growing plain log that yields only new complete lines
+    Log rotated by rename is detected by inode of its path: rest of the old
+    file is read first and then the new one is opened from its start, log
+    truncated in place is read again from its start
+    """
+
+    def __init__(self, file_path: str, offset: int = 0):
+        """
+        :param file_path: Path to plain log file
+        :param offset: Number of bytes already read, a line start
+        """
+        self.file_path = file_path
+        self.log_file = None
+        self.inode = None
+        self.offset = 0
+        self.tail = b''
+        self._open(offset)
+
+    def _open(self, offset: int = 0) -> None:
+        """
+        Method opens log path and seeks to offset, start of file if log
+        is shorter than offset
+        :param offset: Number of bytes already read
+        :return: None
+        """
+        if self.log_file is not None:
+            self.log_file.close()
+        self.log_file = open(self.file_path, 'rb')  # pylint:disable=consider-using-with
+        stat = os.fstat(self.log_file.fileno())
+        self.inode = stat.st_ino
+        self.offset = offset if offset <= stat.st_size else 0
+        self.log_file.seek(self.offset)
+        self.tail = b''
+
+    def _drain(self) -> Iterator[List[bytes]]:
+        """
+        Generator of complete lines from current position to end of file,
+        incomplete last line is kept until its newline is written
+        :return: Iterator of lists of bytes lines
+        """
+        for block in iter(lambda: self.log_file.read(BLOCK_SIZE), b''):
+            block = self.tail + block
+            newline = block.rfind(b'\n')
+            if newline == -1:
+                self.tail = block
+                continue
+            self.tail = block[newline + 1:]
+            self.offset += newline + 1
+            yield split_block(block[:newline + 1])
+
+    def read_blocks(self) -> Iterator[List[bytes]]:
+        """
+        Generator of lines appended since previous call
+        :return: Iterator of lists of bytes lines
+        """
+        yield from self._drain()
+        try:
+            stat = os.stat(self.file_path)
+        except FileNotFoundError:
+            return
+        if stat.st_ino != self.inode \
+                or stat.st_size < self.offset + len(self.tail):
+            self._open()
+            yield from self._drain()
+
+    def close(self) -> None:
+        """
+        Method closes followed file
+        :return: None
+        """
+        self.log_file.close()
@@ -1,42 +1,44 @@
 # -*- coding: utf-8 -*-
-# pylint:disable=anomalous-backslash-in-string
-# pylint:disable=too-many-branches
 
 """
 Report creater module for log_analyzer
 Gets log file on input and parses each line throu regular expression
-If too many lines are broken (50+%) - logs en exception
+If too many lines are broken (BAD_LINES_THRESHOLD, 50% by default) - logs
+en exception, a sample of BAD_LINES_SAMPLE lines is validated first
 Results in a list of lines that fit expression and have max(time_max)
 """
 
-import gzip
+import datetime
 import os
-import re
-import statistics
-from typing import TextIO
+from typing import Iterable, TextIO
 
+from dz1.log_analyzer.fs_utils import (get_log_path,
+                                       load_checkpoint,
+                                       load_day_aggregate,
+                                       log_fingerprint,
+                                       read_time_range,
+                                       save_buckets,
+                                       save_checkpoint,
+                                       save_day_aggregate)
 from dz1.log_analyzer.log import logger
-
-line_format = re.compile(
-    '(?P<remote_addr>(?:^|\b(?<!\.))'
-    '(?:1?\d\d?|2[0-4]\d|25[0-5])(?:\.(?:1?\d\d?|2[0-4]\d|25[0-5])){3}'
-    '(?=$|[^\w.]))\s'
-    '(?P<useless_data>-|\S{0,30})\s{2}'
-    '(?P<remote_usr>-|[a-z_][a-z0-9_]{0,30})\s'
-    '(?P<date_time>\[(?P<date>[0-3][0-9]\/\w{3}\/[12]\d{3}):'
-    '(?P<time>\d\d:\d\d:\d\d).*\])\s(?P<request>\"'
-    '(?P<req_method>GET|POST|HEAD|PUT|DELETE|CONNECT|OPTIONS|TRACE|PATCH)\s'
-    '(?P<req_uri>\S*)\s(?P<http_ver>HTTP/\d\.\d)\")\s'
-    '(?P<status>\d{3})\s'
-    '(?P<body_byte_sent>\d+)\s\"'
-    '(?P<http_referer>[^\s]+)\"\s\"'
-    '(?P<user_agent>[^\"]+)\"\s\"'
-    '(?P<forward_for>[^\"]+)\"\s\"'
-    '(?P<x_req_id>-|\d{0,16}-\d{0,16}-\d{0,16}-\d{0,16})\"\s\"'
-    '(?P<x_rb_usr>\S{0,30})\"\s'
-    '(?P<req_time>\d.\d{0,10})')
+from dz1.log_analyzer.metrics import count_metric, set_metric, stage, timed
+from dz1.log_analyzer.report_creator.aggregate import (aggregate_blocks,
+                                                       aggregate_lines,
+                                                       build_first_k,
+                                                       merge_aggregates,
+                                                       new_aggregate,
+                                                       parsed_lines)
+from dz1.log_analyzer.report_creator.bad_lines import log_bad_lines_summary
+from dz1.log_analyzer.report_creator.buckets import bucket_rows
+from dz1.log_analyzer.report_creator.parallel import aggregate_parallel
+from dz1.log_analyzer.report_creator.reader import (find_lines_end,
+                                                    read_log,
+                                                    sample_lines)
+from dz1.log_analyzer.report_creator.spill import merge_spilled
+from dz1.log_analyzer.report_creator.vectorized import get_aggregator
 
 
+@timed('inner_create_report')
 def inner_create_report(config: dict, log_file: TextIO) -> dict:
     """
     Inner method to use with instead open
@@ -44,77 +46,219 @@ def inner_create_report(config: dict, log_file: TextIO) -> dict:
     :param log_file: List of log file lines
     :return: Dictionary of files matching expression with max(time_max)
     """
-    results = {}
-    total_time = int()
-    bad_reqs = int()
-    for line in log_file:
-        if isinstance(line, bytes):
-            line = line.decode('utf-8')
-
-        data = re.search(line_format, line)
-        if data:
-            datadict = data.groupdict()
-            req_uri = datadict['req_uri']
-            req_time = float(datadict['req_time'])
-            if req_uri not in results:
-                results[req_uri] = {}
-                results[req_uri]['url'] = req_uri
-                results[req_uri]['count'] = 1
-                results[req_uri]['time_sum'] = req_time
-                results[req_uri]['time_max'] = req_time
-                results[req_uri]['median'] = []
-                results[req_uri]['median'].append(req_time)
-            else:
-                results[req_uri]['count'] += 1
-                results[req_uri]['time_sum'] += req_time
-                results[req_uri]['time_max'] = \
-                    max(results[req_uri]['time_max'],
-                        req_time)
-                results[req_uri]['median'].append(req_time)
-            total_time += req_time
-        else:
-            if '"0" 400' not in line:
-                bad_reqs += 1
-                logger.exception('Bad line %s', line)
-    result_tuples = sorted(results.items(), key=lambda x: x[1]['time_sum'],
-                           reverse=True)
-    if bad_reqs / len(result_tuples) * 100 > 50:
-        logger.error('More than 50% of lines were not parsed')
-        raise FileNotFoundError('More than 50% of lines were not parsed')
-
-    if len(result_tuples) > config['REPORT_SIZE']:
-        first_k = dict(result_tuples[:config['REPORT_SIZE']])
+    return build_first_k(config,
+                         aggregate_lines(log_file, new_aggregate(config)))
+
+
+def aggregate_file(config: dict, file_path: str, start: int = 0,
+                   end: int = None, aggregate: dict = None) -> dict:
+    """
+    Method aggregates log file, in a pool of processes if config has
+    WORKERS > 1
+    :param config: Dictionary containing config data from main script
+    :param file_path: Path to log file, plain or gzip
+    :param start: First byte of plain log to aggregate
+    :param end: Byte after the last one to aggregate, file size if None
+    :param aggregate: Aggregate to add lines to, new one if None
+    :return: Aggregate with per-url results and totals
+    """
+    if aggregate is None:
+        aggregate = new_aggregate(config)
+    if not file_path.endswith('.gz'):
+        count_metric('bytes_read', (end if end is not None
+                                    else os.path.getsize(file_path)) - start)
+    if config.get('WORKERS', 1) > 1:
+        return aggregate_parallel(config, file_path, start, end, aggregate)
+    return get_aggregator(config)(read_log(config, file_path, start, end),
+                                  aggregate)
+
+
+def checkpoint_matches(config: dict, checkpoint: dict) -> bool:
+    """
+    Method checks that aggregate of checkpoint was built with the same
+    sketch accuracy, url rules, time buckets and client precision as
+    config asks for
+    :param config: Dictionary containing config data from main script
+    :param checkpoint: Checkpoint from load_checkpoint
+    :return: True if aggregation can resume from checkpoint
+    """
+    aggregate = checkpoint['aggregate']
+    return aggregate['sketch_accuracy'] == config.get('SKETCH_ACCURACY') \
+        and aggregate.get('url_rules') == config.get('URL_RULES') \
+        and aggregate.get('bucket_minutes') == config.get('BUCKET_MINUTES') \
+        and aggregate['results'].client_precision \
+        == config.get('UNIQUE_CLIENTS_PRECISION')
+
+
+def aggregate_incremental(config: dict, file: str) -> dict:
+    """
+    Method resumes aggregation of log file from its checkpoint, so only
+    lines written after the previous run are parsed, and saves a new one
+    Gzip logs can not be resumed and are reparsed if they changed
+    :param config: Dictionary containing config data from main script
+    :param file: Log file name
+    :return: Aggregate with per-url results and totals of whole file
+    """
+    file_path = get_log_path(config, file)
+    checkpoint = load_checkpoint(config, file)
+    if checkpoint is not None and not checkpoint_matches(config, checkpoint):
+        checkpoint = None
+    fingerprint = log_fingerprint(file_path)
+
+    if file.endswith('.gz'):
+        if checkpoint is not None \
+                and checkpoint['offset'] == fingerprint['size']:
+            return checkpoint['aggregate']
+        aggregate = aggregate_file(config, file_path)
+        end = fingerprint['size']
     else:
-        first_k = dict(result_tuples)
-    for item in first_k:
-        first_k[item]['count_perc'] = \
-            first_k[item]['count'] / len(result_tuples) * 100
-        first_k[item]['time_perc'] = \
-            first_k[item]['time_sum'] / total_time * 100
-        first_k[item]['time_med'] = \
-            statistics.median(first_k[item]['median'])
-        first_k[item].pop('median', None)
-    return first_k
+        if checkpoint is None:
+            aggregate, start = new_aggregate(config), 0
+        else:
+            aggregate, start = checkpoint['aggregate'], checkpoint['offset']
+        end = find_lines_end(file_path, fingerprint['size'])
+        if end > start:
+            aggregate_file(config, file_path, start, end, aggregate)
+
+    fingerprint['offset'] = end
+    fingerprint['aggregate'] = aggregate
+    save_checkpoint(config, file, fingerprint)
+    return aggregate
 
 
-def create_report(config: dict, file: str) -> list:
+def validate_sample(config: dict, file_path: str) -> None:
+    """
+    Method parses sample of BAD_LINES_SAMPLE lines of log (prefix or random
+    by BAD_LINES_SAMPLE_MODE) and raises FileNotFoundError if too many of
+    them are broken, so a log of unknown format fails before the full pass
+    :param config: Dictionary containing config data from main script
+    :param file_path: Path to log file
+    :return: None
+    """
+    sample = sample_lines(config, file_path, config['BAD_LINES_SAMPLE'],
+                          config.get('BAD_LINES_SAMPLE_MODE', 'prefix'))
+    aggregate = aggregate_blocks([sample], new_aggregate(config))
+    if aggregate['lines'] and aggregate['bad_reqs'] / aggregate['lines'] \
+            > aggregate['bad_threshold']:
+        logger.error('Sample of %s lines of %s is not parsed',
+                     aggregate['lines'], file_path)
+        raise FileNotFoundError(f'Sample of {file_path} is not parsed')
+
+
+@timed('create_report')
+def create_report(config: dict, file: str,
+                  date: datetime.date = None) -> list:
     """
     Method gets config and log file path as input and results a list
     of requests with maximum time_max
+    If config has INCREMENTAL, aggregation resumes from log checkpoint
+    If config has PERSIST_AGGREGATES, aggregate is saved for rollups
+    If config has BUCKET_MINUTES, time buckets are saved for bucket_query
     :param config: Dictionary containing config data from main script
     :param file: Path to log file to analyze
+    :param date: Date of log file, aggregate is not saved if None
     :return: list of files matching expression with max(time_max)
     """
-    if 'Otus2023/Otus2023' in os.getcwd():
-        file_path = f'{os.getcwd()}/dz1/log_analyzer/' \
-                    f'{config["LOG_DIR"].replace("./", "")}/{file}'
-    else:
-        file_path = f'{os.getcwd()}' + f'/{config["LOG_DIR"]}/{file}'
-    if file.endswith('.gz'):
-        with open(gzip.open(file_path), encoding='bytes') as log_file:
-            first_k = inner_create_report(config, log_file)
-    else:
-        with open(file_path, encoding='utf-8') as log_file:
-            first_k = inner_create_report(config, log_file)
+    if config.get('BAD_LINES_SAMPLE'):
+        with stage('validate_sample'):
+            validate_sample(config, get_log_path(config, file))
+    with stage('aggregate'):
+        if config.get('INCREMENTAL'):
+            aggregate = aggregate_incremental(config, file)
+        else:
+            aggregate = aggregate_file(config, get_log_path(config, file))
+    if aggregate.get('spill_files'):
+        # Persisted aggregate is merged with other days, so it needs every
+        # url, not only report candidates of this day
+        with stage('merge_spilled'):
+            merge_spilled(aggregate, config['REPORT_SIZE'],
+                          keep_all=date is not None
+                          and bool(config.get('PERSIST_AGGREGATES')))
+    set_metric('lines_read', aggregate['lines'])
+    set_metric('lines_parsed', parsed_lines(aggregate))
+    set_metric('bad_lines', aggregate['bad_reqs'])
+    set_metric('slow_path_lines', aggregate['slow_lines'])
+    set_metric('distinct_urls', aggregate.get('distinct_urls')
+               or len(aggregate['results']))
+    for category, count in aggregate.get('bad_categories', {}).items():
+        set_metric(f'bad_lines_{category}', count)
+    log_bad_lines_summary(aggregate)
+
+    with stage('top_k'):
+        first_k = build_first_k(config, aggregate)
+    if date is not None and config.get('PERSIST_AGGREGATES'):
+        with stage('persist_aggregate'):
+            save_day_aggregate(config, date, aggregate)
+    if date is not None and aggregate.get('buckets') is not None:
+        with stage('save_buckets'):
+            save_buckets(config, date, bucket_rows(aggregate))
+    return list(first_k.values())
+
+
+@timed('create_rollup_report')
+def create_rollup_report(config: dict,
+                         dates: Iterable[datetime.date]) -> list:
+    """
+    Method merges stored aggregates of dates into one and results a list
+    of requests with maximum time_max, logs are not read
+    Aggregates with other sketch accuracy, url rules or client precision
+    than the first one can not be merged and are skipped
+    :param config: Dictionary containing config data from main script
+    :param dates: Dates of stored aggregates
+    :return: list of files matching expression with max(time_max)
+    """
+    rollup = None
+    for date in sorted(dates):
+        with stage('load_aggregate'):
+            aggregate = load_day_aggregate(config, date)
+        if aggregate is None:
+            logger.info('No stored aggregate for %s', date)
+            continue
+        if rollup is None:
+            rollup = aggregate
+        elif (aggregate['sketch_accuracy'], aggregate.get('url_rules'),
+              aggregate['results'].client_precision) \
+                != (rollup['sketch_accuracy'], rollup.get('url_rules'),
+                    rollup['results'].client_precision):
+            logger.error('Aggregate for %s has other sketch accuracy, url '
+                         'rules or client precision, skipped', date)
+        else:
+            with stage('merge_aggregate'):
+                merge_aggregates(rollup, aggregate)
+    if rollup is None:
+        raise FileNotFoundError('No stored aggregates to roll up')
+    if rollup.get('spill_files'):
+        with stage('merge_spilled'):
+            merge_spilled(rollup, config['REPORT_SIZE'])
+    set_metric('lines_read', rollup['lines'])
+    set_metric('distinct_urls', rollup.get('distinct_urls')
+               or len(rollup['results']))
+
+    with stage('top_k'):
+        first_k = build_first_k(config, rollup)
+    return list(first_k.values())
+
+
+@timed('create_range_report')
+def create_range_report(config: dict, file: str, start: datetime.datetime,
+                        end: datetime.datetime) -> list:
+    """
+    Method parses only lines of log with $time_local in [start, end),
+    found by time index of the log, and results a list of requests with
+    maximum time_max
+    :param config: Dictionary containing config data from main script
+    :param file: Log file name
+    :param start: First minute of range, naive local time of log
+    :param end: Minute after the range end, naive local time of log
+    :return: list of files matching expression with max(time_max)
+    """
+    with stage('aggregate'):
+        aggregate = get_aggregator(config)(
+            read_time_range(config, file, start, end), new_aggregate(config))
+        merge_spilled(aggregate, config['REPORT_SIZE'])
+    set_metric('lines_read', aggregate['lines'])
+    log_bad_lines_summary(aggregate)
 
+    with stage('top_k'):
+        first_k = build_first_k(config, aggregate)
     return list(first_k.values())
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+
+"""
+Quantile sketch module for report_creator
+Fixed-bucket logarithmic histogram (DDSketch-like): every value is counted
+in bucket ceil(log(value, gamma)), so any quantile is returned with relative
+error not bigger than accuracy and memory depends on values range only
+"""
+
+import math
+
+
+class LogHistogram:
+    """
+    Mergeable quantile sketch with relative error guarantee
+    """
+    __slots__ = ('accuracy', 'gamma', 'log_gamma', 'buckets', 'zeros',
+                 'count')
+
+    def __init__(self, accuracy: float = 0.01):
+        """
+        :param accuracy: Relative error of quantiles, 0 < accuracy < 1
+        """
+        if not 0 < accuracy < 1:
+            raise ValueError('Sketch accuracy must be between 0 and 1')
+        self.accuracy = accuracy
+        self.gamma = (1 + accuracy) / (1 - accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.buckets = {}
+        self.zeros = 0
+        self.count = 0
+
+    def __getstate__(self):
+        return self.accuracy, self.buckets, self.zeros, self.count
+
+    def __setstate__(self, state):
+        accuracy, buckets, zeros, count = state
+        self.__init__(accuracy)
+        self.buckets = buckets
+        self.zeros = zeros
+        self.count = count
+
+    def add(self, value: float) -> None:
+        """
+        Method counts value in its bucket
+        :param value: Non-negative value to add
+        :return: None
+        """
+        self.count += 1
+        if value <= 0:
+            self.zeros += 1
+            return
+        index = math.ceil(math.log(value) / self.log_gamma)
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+
+    def merge(self, other: 'LogHistogram') -> 'LogHistogram':
+        """
+        Method adds counts of other sketch to this one
+        :param other: Sketch with the same accuracy
+        :return: This sketch
+        """
+        if other.accuracy != self.accuracy:
+            raise ValueError('Can not merge sketches with different accuracy')
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        self.zeros += other.zeros
+        self.count += other.count
+        return self
+
+    def quantile(self, quantile: float) -> float:
+        """
+        Method estimates value of quantile
+        :param quantile: Quantile between 0 and 1
+        :return: Estimated value, 0.0 for empty sketch
+        """
+        if self.count == 0:
+            return 0.0
+        rank = quantile * (self.count - 1)
+        seen = self.zeros
+        if rank < seen:
+            return 0.0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if rank < seen:
+                return 2 * self.gamma ** index / (self.gamma + 1)
+        return 2 * self.gamma ** max(self.buckets) / (self.gamma + 1)
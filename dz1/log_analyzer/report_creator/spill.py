@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+
+"""
+External aggregation for report_creator
+If config has SPILL_URLS, url rows are moved out of memory every time the
+in-memory UrlStore gets more urls than that: rows are hash-partitioned by
+url into SPILL_PARTITIONS files and appended there as pickled partial
+stores. Top-k is then selected partition by partition, so only one
+partition of distinct urls is in memory at once
+"""
+
+import os
+import pickle
+import shutil
+import tempfile
+import zlib
+from typing import Iterator
+
+from dz1.log_analyzer.log import logger
+from dz1.log_analyzer.metrics import count_metric
+from dz1.log_analyzer.report_creator.store import UrlStore
+
+SPILL_PARTITIONS = 16
+
+
+def url_partition(url: str, partitions: int) -> int:
+    """
+    Method picks partition of url, crc32 is the same in every process
+    unlike salted hash()
+    :param url: Decoded req_uri
+    :param partitions: Number of partitions
+    :return: Partition number
+    """
+    return zlib.crc32(url.encode('utf-8')) % partitions
+
+
+def spill_needed(aggregate: dict) -> bool:
+    """
+    Method checks if in-memory store of aggregate is over spill_urls
+    :param aggregate: Aggregate with spill_urls
+    :return: True if rows have to be spilled
+    """
+    spill_urls = aggregate.get('spill_urls')
+    return bool(spill_urls) and len(aggregate['results']) > spill_urls
+
+
+def spill(aggregate: dict) -> None:
+    """
+    Method appends every row of in-memory store to file of its partition
+    and replaces store with an empty one
+    :param aggregate: Aggregate with spill_urls and spill_files
+    :return: None
+    """
+    results = aggregate['results']
+    if not results.urls:
+        return
+    partitions = aggregate.get('spill_partitions', SPILL_PARTITIONS)
+    directory = aggregate.get('spill_dir')
+    if directory is None or not os.path.isdir(directory):
+        directory = tempfile.mkdtemp(prefix='log_analyzer-spill-',
+                                     dir=aggregate.get('spill_root'))
+        aggregate['spill_dir'] = directory
+    pieces = [UrlStore(results.sketch_accuracy, results.client_precision)
+              for _ in range(partitions)]
+    for index, url in enumerate(results.urls):
+        pieces[url_partition(url, partitions)].copy_row(results, index)
+    files = aggregate.setdefault('spill_files', {})
+    for partition, piece in enumerate(pieces):
+        path = f'{directory}/partition-{partition:03d}.pickle'
+        with open(path, 'ab') as spill_file:
+            pickle.dump(piece, spill_file, protocol=pickle.HIGHEST_PROTOCOL)
+        paths = files.setdefault(partition, [])
+        if path not in paths:
+            paths.append(path)
+    logger.info('Spilled %s urls to %s', len(results), directory)
+    count_metric('spilled_urls', len(results))
+    aggregate['results'] = UrlStore(results.sketch_accuracy,
+                                    results.client_precision)
+
+
+def _load_pieces(path: str) -> Iterator[UrlStore]:
+    """
+    Generator of partial stores appended to spill file
+    :param path: Path to spill file
+    :return: Iterator of UrlStore
+    """
+    with open(path, 'rb') as spill_file:
+        while True:
+            try:
+                yield pickle.load(spill_file)
+            except EOFError:
+                return
+
+
+def merge_spill_files(target: dict, other: dict) -> dict:
+    """
+    Method adds spill files of other aggregate to target, spilling target
+    if merged store got too big
+    :param target: Aggregate that receives data
+    :param other: Aggregate that is merged in
+    :return: Target aggregate
+    """
+    files = target.setdefault('spill_files', {})
+    for partition, paths in other.get('spill_files', {}).items():
+        files.setdefault(partition, []).extend(paths)
+    if spill_needed(target):
+        spill(target)
+    return target
+
+
+def merge_spilled(aggregate: dict, size: int, keep_all: bool = False) -> dict:
+    """
+    Method merges spilled rows partition by partition and keeps only size
+    rows with max time_sum of every partition in memory, spill files are
+    removed. Number of distinct urls and of parsed lines is saved as
+    distinct_urls and parsed_lines if rows were cut
+    :param aggregate: Aggregate with spill_files
+    :param size: Number of rows report needs
+    :param keep_all: Keep every row, e.g. for aggregate that is persisted
+    :return: Aggregate with candidate rows, or every row, in results
+    """
+    if not aggregate.get('spill_files'):
+        return aggregate
+    spill(aggregate)
+    sketch_accuracy = aggregate['results'].sketch_accuracy
+    client_precision = aggregate['results'].client_precision
+    final = UrlStore(sketch_accuracy, client_precision)
+    distinct_urls, parsed_lines = 0, 0
+    directories = set()
+    for _, paths in sorted(aggregate['spill_files'].items()):
+        store = UrlStore(sketch_accuracy, client_precision)
+        for path in paths:
+            for piece in _load_pieces(path):
+                store.merge(piece)
+            os.remove(path)
+            directories.add(os.path.dirname(path))
+        distinct_urls += len(store)
+        parsed_lines += sum(store.count)
+        for index in range(len(store)) if keep_all else store.top_k(size):
+            final.copy_row(store, index)
+    for directory in directories:
+        shutil.rmtree(directory, ignore_errors=True)
+    aggregate['results'] = final
+    if keep_all:
+        aggregate.pop('distinct_urls', None)
+        aggregate.pop('parsed_lines', None)
+    else:
+        aggregate['distinct_urls'] = distinct_urls
+        aggregate['parsed_lines'] = parsed_lines
+    aggregate['spill_files'] = {}
+    aggregate['spill_dir'] = None
+    return aggregate
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+# Every aggregate column is an attribute of UrlStore
+# pylint:disable=too-many-instance-attributes
+
+"""
+Columnar url store for report_creator
+Every url is interned once and gets an index into parallel arrays of
+count, time_sum and time_max, request time samples are kept in compact
+array('d') per url (or LogHistogram sketch), so per-url overhead is a
+few machine words instead of a dict of dicts
+If client_precision is set, every url also gets HyperLogLog of its clients
+"""
+
+import heapq
+from array import array
+from typing import Iterator, List
+
+from dz1.log_analyzer.report_creator.hll import HyperLogLog
+from dz1.log_analyzer.report_creator.sketch import LogHistogram
+
+
+class UrlStore:
+    """
+    Interned url to index map with parallel aggregate columns
+    """
+    __slots__ = ('sketch_accuracy', 'client_precision', 'index', 'urls',
+                 'count', 'time_sum', 'time_max', 'samples', 'clients')
+
+    def __init__(self, sketch_accuracy: float = None,
+                 client_precision: int = None):
+        """
+        :param sketch_accuracy: Relative error of LogHistogram sketches,
+        exact samples are kept if None
+        :param client_precision: Precision of HyperLogLog of url clients,
+        clients are not counted if None
+        """
+        self.sketch_accuracy = sketch_accuracy
+        self.client_precision = client_precision
+        self.index = {}
+        self.urls = []
+        self.count = array('q')
+        self.time_sum = array('d')
+        self.time_max = array('d')
+        self.samples = []
+        self.clients = []
+
+    def __getstate__(self):
+        return (self.sketch_accuracy, self.urls, self.count, self.time_sum,
+                self.time_max, self.samples, self.client_precision,
+                self.clients)
+
+    def __setstate__(self, state):
+        # Stores pickled before client counting have six fields
+        state = state + (None, [])[len(state) - 6:]
+        (self.sketch_accuracy, self.urls, self.count, self.time_sum,
+         self.time_max, self.samples, self.client_precision,
+         self.clients) = state
+        self.index = {url: index for index, url in enumerate(self.urls)}
+
+    def __len__(self) -> int:
+        return len(self.urls)
+
+    def __contains__(self, url: str) -> bool:
+        return url in self.index
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.urls)
+
+    def get_index(self, url: str) -> int:
+        """
+        Method returns index of url, adding an empty row for a new one
+        :param url: Decoded req_uri
+        :return: Row index in columns
+        """
+        index = self.index.get(url)
+        if index is None:
+            index = len(self.urls)
+            self.index[url] = index
+            self.urls.append(url)
+            self.count.append(0)
+            self.time_sum.append(0.0)
+            self.time_max.append(0.0)
+            if self.sketch_accuracy:
+                self.samples.append(LogHistogram(self.sketch_accuracy))
+            else:
+                self.samples.append(array('d'))
+            if self.client_precision:
+                self.clients.append(HyperLogLog(self.client_precision))
+        return index
+
+    def add(self, index: int, req_time: float) -> None:
+        """
+        Method adds single request time to url row
+        :param index: Row index from get_index
+        :param req_time: Request time
+        :return: None
+        """
+        self.count[index] += 1
+        self.time_sum[index] += req_time
+        if req_time > self.time_max[index]:
+            self.time_max[index] = req_time
+        if self.sketch_accuracy:
+            self.samples[index].add(req_time)
+        else:
+            self.samples[index].append(req_time)
+
+    def merge(self, other: 'UrlStore') -> 'UrlStore':
+        """
+        Method adds rows of other store to this one
+        :param other: Store with the same sketch accuracy
+        :return: This store
+        """
+        for other_index, url in enumerate(other.urls):
+            index = self.get_index(url)
+            self.count[index] += other.count[other_index]
+            self.time_sum[index] += other.time_sum[other_index]
+            if other.time_max[other_index] > self.time_max[index]:
+                self.time_max[index] = other.time_max[other_index]
+            if self.sketch_accuracy:
+                self.samples[index].merge(other.samples[other_index])
+            else:
+                self.samples[index].extend(other.samples[other_index])
+            if self.client_precision:
+                self.clients[index].merge(other.clients[other_index])
+        return self
+
+    def copy_row(self, other: 'UrlStore', other_index: int) -> int:
+        """
+        Method moves row of other store into this one, sketches and samples
+        are shared, not copied
+        :param other: Store with the same sketch accuracy
+        :param other_index: Row index in other store
+        :return: Row index in this store
+        """
+        index = self.get_index(other.urls[other_index])
+        self.count[index] = other.count[other_index]
+        self.time_sum[index] = other.time_sum[other_index]
+        self.time_max[index] = other.time_max[other_index]
+        self.samples[index] = other.samples[other_index]
+        if self.client_precision:
+            self.clients[index] = other.clients[other_index]
+        return index
+
+    def top_k(self, size: int) -> List[int]:
+        """
+        Method selects rows with max time_sum with a heap of size rows,
+        O(n log size) instead of sorting every url
+        :param size: Number of rows to select
+        :return: Row indexes ordered by time_sum descending
+        """
+        return heapq.nlargest(size, range(len(self.urls)),
+                              key=self.time_sum.__getitem__)
+
+    def row(self, index: int) -> dict:
+        """
+        Method builds report row of url without percentages and medians
+        :param index: Row index
+        :return: Dictionary with url, count, time_sum, time_max and
+        unique_clients if clients are counted
+        """
+        row = {'url': self.urls[index],
+               'count': self.count[index],
+               'time_sum': self.time_sum[index],
+               'time_max': self.time_max[index]}
+        if self.client_precision:
+            row['unique_clients'] = self.clients[index].count()
+        return row
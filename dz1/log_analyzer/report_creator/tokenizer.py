@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+
+"""
+Fast-path tokenizer for ui_short log format
+Matches bytes line with an anchored pattern that accepts only a strict
+subset of line_format regex: IPv4 without leading zeros, single spaces
+between fields, no quotes inside fields. Only req_uri and req_time are
+captured, there is no lookbehind and no backtracking over quotes, so it
+is about twice as fast as line_format and gives the same req_uri and
+req_time for every line it accepts. Lines it can not handle are left to
+the full line_format regex
+"""
+
+import re
+from typing import Optional, Tuple
+
+REQUEST_METHODS = frozenset((b'GET', b'POST', b'HEAD', b'PUT', b'DELETE',
+                             b'CONNECT', b'OPTIONS', b'TRACE', b'PATCH'))
+UI_SHORT_QUOTES = 12
+IPV4_OCTET = rb'(?:25[0-5]|2[0-4]\d|1\d\d|[1-9]?\d)'
+ui_short_fast = re.compile(
+    IPV4_OCTET + rb'(?:\.' + IPV4_OCTET + rb'){3} '
+    rb'\S{1,30}  (?:-|[a-z_][a-z0-9_]{0,30}) '
+    rb'\[[0-3]\d/[A-Za-z]{3}/[12]\d{3}:\d\d:\d\d[^"\n]*\] '
+    rb'"(?:' + b'|'.join(sorted(REQUEST_METHODS)) + rb') (\S*) HTTP/\d\.\d" '
+    rb'\d{3} \d+ "[^\s"]+" "[^"]+" "[^"]+" '
+    rb'"(?:-|\d{0,16}-\d{0,16}-\d{0,16}-\d{0,16})" "[^\s"]{0,30}" '
+    rb'(\d.\d{0,10})')
+
+
+def parse_ui_short(line: bytes) -> Optional[Tuple[bytes, float]]:
+    """
+    Method extracts req_uri and req_time from ui_short formatted line
+    :param line: Single log line
+    :return: Tuple of raw req_uri and req_time, None if fast path rejects line
+    """
+    # With exactly 12 quotes line_format can align its fields only one way,
+    # so captures of both patterns are the same
+    if line.count(b'"') != UI_SHORT_QUOTES:
+        return None
+    data = ui_short_fast.match(line)
+    if data is None:
+        return None
+    try:
+        return data.group(1), float(data.group(2))
+    except ValueError:
+        return None
+
+
+def parse_minute(line: bytes) -> Optional[int]:
+    """
+    Method extracts minute of day from time_local of ui_short formatted line
+    :param line: Single log line
+    :return: Minutes since midnight, None if time_local is not found
+    """
+    # [29/Jun/2017:03:50:22 +0300]
+    start = line.find(b'[')
+    if start == -1 or line[start + 12:start + 13] != b':':
+        return None
+    try:
+        return int(line[start + 13:start + 15]) * 60 \
+            + int(line[start + 16:start + 18])
+    except ValueError:
+        return None
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+# pylint:disable=too-many-locals
+
+"""
+Vectorized NumPy aggregation backend for report_creator
+Lines are only parsed in python loop: (url index, req_time) pairs are
+buffered into arrays of VECTOR_BLOCK_LINES and count, time_sum and
+time_max are computed with np.bincount and np.maximum.at, samples are
+grouped by url with a single sort-by-key pass per block
+Used when config has AGGREGATION_BACKEND set to 'numpy'
+"""
+
+import functools
+from array import array
+from typing import Callable, Iterable
+
+from dz1.log_analyzer.report_creator.aggregate import (aggregate_blocks,
+                                                       new_aggregate,
+                                                       parse_blocks)
+
+VECTOR_BLOCK_LINES = 1024 * 1024
+
+# numpy takes longer to import than the rest of the analyzer, it is
+# imported on the first call of aggregate_blocks_numpy
+np = None  # pylint:disable=invalid-name
+
+
+def _import_numpy() -> None:
+    """
+    Method imports numpy to module global np on first use
+    :return: None
+    """
+    global np  # pylint: disable=global-statement,invalid-name
+    if np is None:
+        try:
+            import numpy  # pylint: disable=import-outside-toplevel
+        except ImportError as exception:
+            raise ImportError('AGGREGATION_BACKEND numpy requires numpy') \
+                from exception
+        np = numpy
+
+
+def _flush(aggregate: dict, url_ids: array, req_times: array) -> None:
+    """
+    Method adds buffered pairs to aggregate columns and empties buffers
+    :param aggregate: Aggregate to update
+    :param url_ids: Buffer of url indexes
+    :param req_times: Buffer of request times
+    :return: None
+    """
+    if not url_ids:
+        return
+    results = aggregate['results']
+    size = len(results)
+    ids = np.frombuffer(url_ids, dtype=np.int64)
+    times = np.frombuffer(req_times, dtype=np.float64)
+
+    count = np.frombuffer(results.count, dtype=np.int64)
+    count += np.bincount(ids, minlength=size)
+    time_sum = np.frombuffer(results.time_sum, dtype=np.float64)
+    time_sum += np.bincount(ids, weights=times, minlength=size)
+    time_max = np.frombuffer(results.time_max, dtype=np.float64)
+    np.maximum.at(time_max, ids, times)
+    aggregate['total_time'] += float(times.sum())
+
+    order = np.argsort(ids, kind='stable')
+    sorted_ids = ids[order]
+    sorted_times = times[order]
+    borders = np.flatnonzero(np.diff(sorted_ids)) + 1
+    starts = np.concatenate(([0], borders))
+    ends = np.concatenate((borders, [len(sorted_ids)]))
+    for start, end in zip(starts.tolist(), ends.tolist()):
+        samples = results.samples[int(sorted_ids[start])]
+        if results.sketch_accuracy:
+            for req_time in sorted_times[start:end].tolist():
+                samples.add(req_time)
+        else:
+            samples.frombytes(sorted_times[start:end].tobytes())
+    # Views must be released before url columns and buffers change size
+    del ids, times, count, time_sum, time_max, sorted_ids, sorted_times
+    del url_ids[:], req_times[:]
+
+
+def aggregate_blocks_numpy(blocks: Iterable[Iterable[bytes]],
+                           aggregate: dict = None) -> dict:
+    """
+    Method parses blocks of bytes lines and adds them to aggregate with
+    vectorized NumPy updates, result is the same as of aggregate_blocks
+    :param blocks: Iterable of lists of bytes lines
+    :param aggregate: Aggregate to update, new one is created if None
+    :return: Aggregate with per-url results and totals
+    """
+    _import_numpy()
+    if aggregate is None:
+        aggregate = new_aggregate()
+    url_ids, req_times = array('q'), array('d')
+    flush = functools.partial(_flush, aggregate, url_ids, req_times)
+    for _, index, req_time in parse_blocks(blocks, aggregate, flush):
+        url_ids.append(index)
+        req_times.append(req_time)
+        if len(url_ids) >= VECTOR_BLOCK_LINES:
+            flush()
+    flush()
+    return aggregate
+
+
+def get_aggregator(config: dict) -> Callable:
+    """
+    Method picks aggregation function by AGGREGATION_BACKEND
+    :param config: Dictionary containing config data from main script
+    :return: aggregate_blocks_numpy for 'numpy', aggregate_blocks otherwise
+    or with BUCKET_MINUTES
+    """
+    if config.get('AGGREGATION_BACKEND') == 'numpy' \
+            and not config.get('BUCKET_MINUTES'):
+        return aggregate_blocks_numpy
+    return aggregate_blocks
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Time range tool for raw logs
+Prints lines of a log written in a time range, or a table of urls with max
+time_sum of that range, reading the log from positions of its time index
+instead of scanning it
+python -m dz1.log_analyzer.time_range --log nginx-access-ui.log-20170630 \
+    --start '2017.06.29 14:00' --end '2017.06.29 14:10' --top 20
+"""
+
+import argparse
+import datetime
+import sys
+
+from dz1.log_analyzer.fs_utils import (load_external_config,
+                                       check_for_logs,
+                                       read_time_range)
+from dz1.log_analyzer.report_creator import create_range_report
+
+config = {"REPORT_SIZE": 1000, "REPORT_DIR": "./output",
+          "LOG_DIR": "./input"}
+
+parser = argparse.ArgumentParser(
+    prog='TimeRange',
+    description='Reads a time range of a log through its time index')
+parser.add_argument('-c', '--config')
+parser.add_argument('-l', '--log', help='Log file name, latest if absent')
+parser.add_argument('-s', '--start', required=True,
+                    help='YYYY.MM.DD HH:MM of $time_local')
+parser.add_argument('-e', '--end', required=True,
+                    help='YYYY.MM.DD HH:MM of $time_local, not included')
+parser.add_argument('-t', '--top', type=int,
+                    help='Print urls with max time_sum instead of lines')
+
+
+def main():
+    """
+    Main time range method - prints lines or top urls of the range
+    :return: None
+    """
+    args = parser.parse_args()
+    if args.config:
+        load_external_config(args, config)
+    start = datetime.datetime.strptime(args.start, '%Y.%m.%d %H:%M')
+    end = datetime.datetime.strptime(args.end, '%Y.%m.%d %H:%M')
+    log_file = args.log
+    if log_file is None:
+        logs = check_for_logs(config)
+        if not logs:
+            sys.exit('No logs to read')
+        log_file = logs[max(logs)]
+
+    if args.top:
+        config['REPORT_SIZE'] = args.top
+        try:
+            rows = create_range_report(config, log_file, start, end)
+        except FileNotFoundError as exception:
+            sys.exit(str(exception))
+        for row in rows:
+            print(f'{row["time_sum"]:.3f}\t{row["count"]}\t'
+                  f'{row["time_max"]:.3f}\t{row["url"]}')
+        return
+
+    for lines in read_time_range(config, log_file, start, end):
+        for line in lines:
+            sys.stdout.buffer.write(line + b'\n')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+"""
+Throughput benchmark of gzip decompression backends of report_creator
+Generates gzip ui_short log and aggregates it with every available
+GZIP_BACKEND, printing MB/s of decompressed data and lines/s
+Run example: python -m dz1.log_analyzer_benchmarks.bench_gzip_backends 500000
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from dz1.log_analyzer.report_creator import (aggregate_blocks,
+                                             new_aggregate,
+                                             read_gzip)
+from dz1.log_analyzer.report_creator.reader import GZIP_COMMANDS
+from dz1.log_analyzer_benchmarks.log_generator import generate_log
+
+
+def main():
+    """
+    Method prints throughput of every available gzip backend
+    :return: None
+    """
+    lines = int(sys.argv[1]) if len(sys.argv) > 1 else 500000
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'nginx-access-ui.log-20170630.gz')
+        size = generate_log(path, lines)
+        backends = ['gzip', 'thread'] + [name for name, command
+                                         in GZIP_COMMANDS.items()
+                                         if shutil.which(command[0])]
+        print(f'{lines} lines, {size / 2 ** 20:.1f} MiB decompressed, '
+              f'{os.cpu_count()} cpus')
+        for backend in backends:
+            started = time.perf_counter()
+            aggregate_blocks(read_gzip(path, backend), new_aggregate())
+            elapsed = time.perf_counter() - started
+            print(f'{backend:>6}: {elapsed:.2f} s, '
+                  f'{size / 2 ** 20 / elapsed:.1f} MiB/s, '
+                  f'{lines / elapsed:.0f} lines/s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+"""
+Throughput benchmark of log_analyzer on a synthetic log
+Measures lines/s, peak RSS and per-stage timings: reading, parsing,
+aggregation, top-K and rendering, and writes results as JSON, so runs can
+be compared to track regressions
+Log is streamed, so peak RSS is the footprint of analysis and not of the
+benchmark. Aggregation is the time of a streamed pass without the time of
+reading, parsing is timed with tokenizer alone on first PARSE_SAMPLE_LINES
+lines and reported as parse_lines_per_second
+Run example:
+python -m dz1.log_analyzer_benchmarks.bench_log_analyzer --lines 1000000 \
+    --gzip --output bench.json
+"""
+
+import argparse
+import datetime
+import json
+import os
+import resource
+import shutil
+import tempfile
+import time
+
+from dz1.log_analyzer.fs_utils import create_and_copy_report
+from dz1.log_analyzer.report_creator import (build_first_k,
+                                             get_aggregator,
+                                             new_aggregate,
+                                             parse_ui_short,
+                                             read_log)
+from dz1.log_analyzer_benchmarks.log_generator import generate_log
+
+TEMPLATE = f'{os.path.dirname(__file__)}/../log_analyzer/jquery/report.html'
+PARSE_SAMPLE_LINES = 100000
+
+
+def peak_rss_mb() -> float:
+    """
+    Method returns peak resident set size of this process
+    :return: Peak RSS in MiB
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def time_parse(config: dict, log_path: str,
+               sample_lines: int = PARSE_SAMPLE_LINES) -> float:
+    """
+    Method times tokenizer alone on first sample_lines of log, only the
+    sample is kept in memory
+    :param config: Dictionary containing log_analyzer config
+    :param log_path: Path to generated log
+    :param sample_lines: Number of lines to parse
+    :return: Parsed lines per second
+    """
+    sample = []
+    for block in read_log(config, log_path):
+        sample.extend(block[:sample_lines - len(sample)])
+        if len(sample) >= sample_lines:
+            break
+    started = time.perf_counter()
+    for line in sample:
+        parse_ui_short(line)
+    return len(sample) / max(time.perf_counter() - started, 1e-9)
+
+
+def run_benchmark(config: dict, log_path: str) -> dict:
+    """
+    Method runs every stage of log analysis on log and times it, log is
+    streamed like in log_analyzer, so peak RSS is the analyzer footprint
+    :param config: Dictionary containing log_analyzer config
+    :param log_path: Path to generated log
+    :return: Dictionary of stage timings and throughput
+    """
+    timings = {}
+    started = time.perf_counter()
+    lines = sum(len(block) for block in read_log(config, log_path))
+    timings['read'] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    aggregate = get_aggregator(config)(read_log(config, log_path),
+                                       new_aggregate(config))
+    timings['aggregate'] = max(0.0, time.perf_counter() - started
+                               - timings['read'])
+
+    started = time.perf_counter()
+    first_k = build_first_k(config, aggregate)
+    timings['top_k'] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    create_and_copy_report('report-2017.06.29', config,
+                           list(first_k.values()))
+    timings['render'] = time.perf_counter() - started
+    peak_rss = peak_rss_mb()
+
+    total = sum(timings.values())
+    return {'lines': lines,
+            'distinct_urls': len(aggregate['results']),
+            'bad_lines': aggregate['bad_reqs'],
+            'slow_path_lines': aggregate['slow_lines'],
+            'timings': timings,
+            'total_seconds': total,
+            'lines_per_second': lines / total,
+            'parse_lines_per_second': time_parse(config, log_path),
+            'peak_rss_mb': peak_rss}
+
+
+def main():
+    """
+    Method generates log, runs benchmark and writes JSON result
+    :return: None
+    """
+    arg_parser = argparse.ArgumentParser(
+        description='Benchmarks log_analyzer on a synthetic log')
+    arg_parser.add_argument('--lines', type=int, default=1000000)
+    arg_parser.add_argument('--urls', type=int, default=10000)
+    arg_parser.add_argument('--zipf', type=float, default=1.1)
+    arg_parser.add_argument('--malformed', type=float, default=0.0)
+    arg_parser.add_argument('--gzip', action='store_true')
+    arg_parser.add_argument('--seed', type=int, default=0)
+    arg_parser.add_argument('--config', default='{}',
+                            help='JSON with extra log_analyzer config')
+    arg_parser.add_argument('--output', default='bench_results.json',
+                            help='JSON file results are appended to')
+    args = arg_parser.parse_args()
+
+    config = {'REPORT_SIZE': 1000, 'REPORT_DIR': 'output'}
+    config.update(json.loads(args.config))
+    cwd = os.getcwd()
+    output = os.path.abspath(args.output)
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        try:
+            os.makedirs('jquery')
+            os.makedirs('output')
+            shutil.copy(TEMPLATE, 'jquery/report.html')
+            log_path = os.path.join(
+                directory, 'nginx-access-ui.log-20170629'
+                + ('.gz' if args.gzip else ''))
+            size = generate_log(log_path, args.lines, urls=args.urls,
+                                exponent=args.zipf,
+                                malformed=args.malformed, seed=args.seed)
+            result = run_benchmark(config, log_path)
+        finally:
+            os.chdir(cwd)
+
+    result['params'] = dict(vars(args), config=config, bytes=size)
+    result['date'] = datetime.datetime.now().isoformat(timespec='seconds')
+    results = []
+    if os.path.exists(output):
+        with open(output, encoding='utf-8') as file:
+            results = json.load(file)
+    results.append(result)
+    with open(output, 'w', encoding='utf-8') as file:
+        json.dump(results, file, indent=2)
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == '__main__':
+    main()
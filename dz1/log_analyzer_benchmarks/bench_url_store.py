@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""
+Memory benchmark of per-url aggregates: dict of dicts with sample lists
+that inner_create_report used to keep against columnar UrlStore
+Run example: python -m dz1.log_analyzer_benchmarks.bench_url_store 1000000 5
+"""
+
+import random
+import sys
+import tracemalloc
+
+from dz1.log_analyzer.report_creator import UrlStore
+
+
+def fill_dicts(urls: list, samples: int) -> dict:
+    """
+    Method fills dict of dicts the way inner_create_report used to
+    :param urls: List of urls
+    :param samples: Number of request times per url
+    :return: Dictionary of url rows
+    """
+    results = {}
+    for url in urls:
+        for _ in range(samples):
+            req_time = random.random()
+            if url not in results:
+                results[url] = {'url': url,
+                                'count': 1,
+                                'time_sum': req_time,
+                                'time_max': req_time,
+                                'median': [req_time]}
+            else:
+                results[url]['count'] += 1
+                results[url]['time_sum'] += req_time
+                results[url]['time_max'] = max(results[url]['time_max'],
+                                               req_time)
+                results[url]['median'].append(req_time)
+    return results
+
+
+def fill_store(urls: list, samples: int) -> UrlStore:
+    """
+    Method fills columnar UrlStore
+    :param urls: List of urls
+    :param samples: Number of request times per url
+    :return: Filled store
+    """
+    store = UrlStore()
+    for url in urls:
+        index = store.get_index(url)
+        for _ in range(samples):
+            store.add(index, random.random())
+    return store
+
+
+def measure(fill, urls: list, samples: int) -> int:
+    """
+    Method measures memory held by structure built by fill
+    :param fill: Function that builds structure
+    :param urls: List of urls
+    :param samples: Number of request times per url
+    :return: Number of bytes allocated and still held
+    """
+    tracemalloc.start()
+    structure = fill(urls, samples)
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del structure
+    return size
+
+
+def main():
+    """
+    Method prints memory of both structures for URLS urls with SAMPLES
+    request times each, given as command line arguments
+    :return: None
+    """
+    url_count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    samples = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    urls = [f'/api/v2/banner/{index}' for index in range(url_count)]
+    dicts = measure(fill_dicts, urls, samples)
+    store = measure(fill_store, urls, samples)
+    print(f'{url_count} urls, {samples} samples per url')
+    print(f'dict of dicts: {dicts / 2 ** 20:.1f} MiB '
+          f'({dicts / url_count:.0f} B/url)')
+    print(f'UrlStore:      {store / 2 ** 20:.1f} MiB '
+          f'({store / url_count:.0f} B/url)')
+
+
+if __name__ == '__main__':
+    main()
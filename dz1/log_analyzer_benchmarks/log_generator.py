@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+"""
+Synthetic nginx ui_short log generator for benchmarks
+Urls popularity follows Zipf distribution, a share of lines can be
+malformed and output can be plain or gzip
+Run example:
+python -m dz1.log_analyzer_benchmarks.log_generator out.log.gz --lines 1000000
+"""
+
+import argparse
+import gzip
+import itertools
+import random
+
+METHODS = ('GET', 'GET', 'GET', 'POST', 'PUT', 'DELETE')
+AGENTS = ('Lynx/2.8.8dev.9 libwww-FM/2.14 SSL-MM/1.4.1 GNUTLS/2.10.5',
+          'Python-urllib/2.7',
+          'Mozilla/5.0 (Windows NT 6.1; WOW64) AppleWebKit/537.36')
+PATHS = ('/api/v2/banner/{}', '/api/1/photogenic_banners/list/?id={}',
+         '/api/v2/slot/{}/groups', '/export/appinstall_raw/{}/')
+LINE = '{ip} {user}  - [29/Jun/2017:{hour:02d}:{minute:02d}:{second:02d} ' \
+       '+0300] "{method} {url} HTTP/1.1" 200 {size} "-" "{agent}" "-" ' \
+       '"1498697422-2190034393-4708-{request_id}" "dc7161be3" {time:.3f}\n'
+GENERATION_BATCH = 10000
+
+
+def zipf_cum_weights(urls: int, exponent: float) -> list:
+    """
+    Method builds cumulative weights of Zipf distribution over url ranks
+    :param urls: Number of distinct urls
+    :param exponent: Zipf exponent, 0 is uniform
+    :return: List of cumulative weights for random.choices
+    """
+    return list(itertools.accumulate(1 / rank ** exponent
+                                     for rank in range(1, urls + 1)))
+
+
+def generate_lines(lines: int, urls: int = 10000, exponent: float = 1.1,
+                   malformed: float = 0.0, seed: int = 0):
+    """
+    Generator of synthetic ui_short log lines
+    :param lines: Number of lines
+    :param urls: Number of distinct urls
+    :param exponent: Zipf exponent of url popularity
+    :param malformed: Share of malformed lines, 0..1
+    :param seed: Random seed, same seed gives same log
+    :return: Iterator of str lines
+    """
+    rand = random.Random(seed)
+    cum_weights = zipf_cum_weights(urls, exponent)
+    ranks = range(urls)
+    produced = 0
+    while produced < lines:
+        batch = min(GENERATION_BATCH, lines - produced)
+        for rank in rand.choices(ranks, cum_weights=cum_weights, k=batch):
+            second = produced * 86400 // lines
+            line = LINE.format(
+                ip=f'1.{rank % 256}.{rand.randint(0, 255)}.'
+                   f'{rand.randint(1, 254)}',
+                user='-',
+                hour=second // 3600, minute=second // 60 % 60,
+                second=second % 60,
+                method=rand.choice(METHODS),
+                url=PATHS[rank % len(PATHS)].format(rank),
+                size=rand.randint(0, 100000),
+                agent=rand.choice(AGENTS),
+                request_id=produced,
+                time=min(9.999,
+                         rand.expovariate(1 / (0.05 + rank % 7 * 0.1))))
+            if malformed and rand.random() < malformed:
+                line = line[:rand.randint(0, len(line) - 2)] + '\n'
+            produced += 1
+            yield line
+
+
+def generate_log(path: str, lines: int, **options) -> int:
+    """
+    Method writes synthetic log, gzip if path ends with .gz
+    :param path: Path to log file
+    :param lines: Number of lines
+    :param options: urls, exponent, malformed and seed of generate_lines
+    :return: Number of uncompressed bytes written
+    """
+    opener = gzip.open if path.endswith('.gz') else open
+    size = 0
+    with opener(path, 'wt', encoding='utf-8') as log_file:
+        for line in generate_lines(lines, **options):
+            size += len(line)
+            log_file.write(line)
+    return size
+
+
+def main():
+    """
+    Method generates log with parameters from command line
+    :return: None
+    """
+    arg_parser = argparse.ArgumentParser(
+        description='Generates synthetic nginx ui_short log')
+    arg_parser.add_argument('path', help='Output file, gzip if ends with .gz')
+    arg_parser.add_argument('--lines', type=int, default=1000000)
+    arg_parser.add_argument('--urls', type=int, default=10000)
+    arg_parser.add_argument('--zipf', type=float, default=1.1)
+    arg_parser.add_argument('--malformed', type=float, default=0.0)
+    arg_parser.add_argument('--seed', type=int, default=0)
+    args = arg_parser.parse_args()
+    size = generate_log(args.path, args.lines, urls=args.urls,
+                        exponent=args.zipf, malformed=args.malformed,
+                        seed=args.seed)
+    print(f'{args.lines} lines, {size / 2 ** 20:.1f} MiB written')
+
+
+if __name__ == '__main__':
+    main()
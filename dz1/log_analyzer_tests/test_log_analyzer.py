@@ -5,13 +5,75 @@ Tests for log_analyzer
 """
 
 import copy
+import gzip
 import json
 import os
+import shutil
+import subprocess
+import sys
+import threading
+import time
+from datetime import date, datetime
+
+import pytest
 
 from dz1.log_analyzer.fs_utils import (load_external_config,
+                                       check_for_aggregates,
+                                       create_and_copy_report,
                                        check_for_logs,
-                                       check_for_reports)
-from dz1.log_analyzer.report_creator import create_report
+                                       check_for_new_bytes,
+                                       check_for_reports,
+                                       load_checkpoint,
+                                       query_buckets,
+                                       read_time_range)
+from dz1.log_analyzer import log_analyzer
+from dz1.log_analyzer.log_analyzer import analyze_log, backfill, rollup
+from dz1.log_analyzer.metrics import get_metrics, reset_metrics
+from dz1.log_analyzer.report_creator.reader import (GZIP_COMMANDS,
+                                                    GZIP_QUEUE_SIZE,
+                                                    iter_blocks)
+from dz1.log_analyzer_benchmarks.log_generator import generate_lines
+from dz1.log_analyzer.report_creator import (aggregate_blocks,
+                                             aggregate_lines,
+                                             aggregate_parallel,
+                                             bad_line_category,
+                                             bad_lines_exceeded,
+                                             build_first_k,
+                                             client_hash,
+                                             create_report,
+                                             create_rollup_report,
+                                             HyperLogLog,
+                                             inner_create_report,
+                                             iter_gzip_raw_blocks,
+                                             line_format_bytes,
+                                             LogHistogram,
+                                             LogTail,
+                                             log_bad_lines_summary,
+                                             merge_aggregates,
+                                             new_aggregate,
+                                             parse_ui_short,
+                                             read_gzip,
+                                             read_mmap,
+                                             read_range,
+                                             split_ranges,
+                                             UrlStore,
+                                             validate_sample)
+
+STARTUP_IMPORT_BUDGET_US = 80000
+
+
+@pytest.fixture(name='workdir')
+def fixture_workdir(tmp_path, monkeypatch):
+    """
+    Fixture that changes to temporary directory with input and output
+    directories and report template, the layout log_analyzer expects
+    :return: None
+    """
+    monkeypatch.chdir(tmp_path)
+    for directory in ('input', 'output', 'jquery'):
+        os.mkdir(directory)
+    shutil.copy(f'{os.path.dirname(__file__)}/../log_analyzer/jquery/'
+                f'report.html', 'jquery/report.html')
 
 
 def test_load_external_config():
@@ -110,3 +172,795 @@ def test_report_creator():
                  'time_med': 0.133}]
 
     assert result == expected, 'report creator does not work properly'
+
+
+def test_split_ranges(tmp_path):
+    """
+    Test that byte ranges cover whole file and end on line borders
+    """
+    log_path = tmp_path / 'nginx-access-ui.log-20100102'
+    log_path.write_bytes(b''.join(f'line {i}\n'.encode() for i in range(50)))
+    ranges = split_ranges(str(log_path), 4)
+    data = log_path.read_bytes()
+
+    assert ranges[0][0] == 0 and ranges[-1][1] == len(data)
+    for (_, end), (start, _) in zip(ranges, ranges[1:]):
+        assert end == start and data[end - 1:end] == b'\n'
+
+
+def test_parallel_report_creator(tmp_path):
+    """
+    Test that parallel aggregation gives the same report as a single process
+    """
+    config = {
+        "REPORT_SIZE": 1000,
+        "REPORT_DIR": "./bad_output",
+        "LOG_DIR": "./input"
+        }
+    source = f'{os.path.dirname(__file__)}/input/nginx-access-ui.log-20100101'
+    with open(source, encoding='utf-8') as file:
+        lines = file.read().splitlines(keepends=True)
+    log_path = tmp_path / 'nginx-access-ui.log-20100102'
+    log_path.write_text(''.join(lines * 20), encoding='utf-8')
+
+    with open(log_path, encoding='utf-8') as log_file:
+        expected = inner_create_report(config, log_file)
+    config['WORKERS'] = 3
+    result = build_first_k(config, aggregate_parallel(config, str(log_path)))
+
+    assert result.keys() == expected.keys()
+    for url, data in expected.items():
+        assert result[url]['count'] == data['count']
+        assert abs(result[url]['time_sum'] - data['time_sum']) < 1e-9
+        assert result[url]['time_med'] == data['time_med']
+
+
+def test_ui_short_tokenizer():
+    """
+    Test that fast path tokenizer agrees with line_format regex
+    """
+    source = f'{os.path.dirname(__file__)}/input/nginx-access-ui.log-20100101'
+    with open(source, 'rb') as file:
+        lines = file.readlines()
+    for line in lines:
+        data = line_format_bytes.search(line)
+        assert parse_ui_short(line) == (data.group('req_uri'),
+                                        float(data.group('req_time')))
+    assert parse_ui_short(b'garbage "line" 0.1') is None
+    assert parse_ui_short(lines[0].replace(b'"GET', b'"FETCH')) is None
+
+    variants = [
+        lines[0].replace(b'1.196.116.32', b'2001:db8::1'),
+        lines[0].replace(b'1.196.116.32 ', b''),
+        lines[0].replace(b'1.196.116.32', b'1.196.116.320'),
+        lines[0].replace(b'"1498697422-2190034393-4708-9752759"',
+                         b'"1498697422-2190034393"'),
+        lines[0].replace(b' -  - ', b' - - '),
+        lines[0].replace(b'HTTP/1.1', b'HTTP/2'),
+        lines[0].replace(b'"-" "Lynx', b'"- x" "Lynx'),
+        lines[0].replace(b' 200 ', b' 20 '),
+        lines[0].replace(b' 0.390', b' 12.5'),
+        lines[0].replace(b' 0.390', b' 7'),
+        ]
+    for line in variants:
+        data = line_format_bytes.search(line)
+        expected = None if data is None \
+            else (data.group('req_uri'), float(data.group('req_time')))
+        assert parse_ui_short(line) in (None, expected), line
+        if expected is None:
+            assert parse_ui_short(line) is None, line
+    # Regex captures digit, any char and up to 10 digits
+    assert parse_ui_short(variants[8]) == (b'/api/v2/banner/25019354', 12.0)
+
+    aggregate = aggregate_lines(lines + [b'garbage "line" 0.1\n'] + variants)
+    assert aggregate['bad_reqs'] == 1 + sum(
+        line_format_bytes.search(line) is None for line in variants)
+
+
+def test_read_range_blocks(tmp_path):
+    """
+    Test that block reader returns the same lines as readline
+    """
+    log_path = tmp_path / 'nginx-access-ui.log-20100102'
+    lines = [f'line {i}'.encode() * (i % 7 + 1) for i in range(500)]
+    log_path.write_bytes(b'\n'.join(lines))
+
+    with open(log_path, 'rb') as log_file:
+        blocks = list(iter_blocks(log_file, block_size=64))
+    assert [line for block in blocks for line in block] == lines
+    end = len(b'\n'.join(lines[:7])) + 1
+    assert [line for block in read_range(str(log_path), 0, end)
+            for line in block] == lines[:7]
+
+
+def test_read_mmap_ranges(tmp_path):
+    """
+    Test that mmap reader returns the same lines for every shard range
+    """
+    log_path = tmp_path / 'nginx-access-ui.log-20100102'
+    lines = [f'line {i}'.encode() * (i % 50 + 1) for i in range(3000)]
+    log_path.write_bytes(b'\n'.join(lines) + b'\n')
+
+    result = []
+    for start, end in split_ranges(str(log_path), 5):
+        result.extend(line for block
+                      in read_mmap(str(log_path), start, end, block_size=100)
+                      for line in block)
+    assert result == lines
+
+
+def test_log_histogram():
+    """
+    Test that sketch quantiles stay within relative error after merge
+    """
+    values = [i / 1000 for i in range(1, 10001)]
+    first, second = LogHistogram(0.01), LogHistogram(0.01)
+    for value in values[::2]:
+        first.add(value)
+    for value in values[1::2]:
+        second.add(value)
+    sketch = first.merge(second)
+
+    assert sketch.count == len(values)
+    for quantile in (0.5, 0.9, 0.95, 0.99):
+        exact = values[int(quantile * (len(values) - 1))]
+        assert abs(sketch.quantile(quantile) - exact) <= exact * 0.01
+
+
+def test_report_creator_sketch():
+    """
+    Test that sketch mode adds percentile columns to report
+    """
+    config = {
+        "REPORT_SIZE": 1000,
+        "REPORT_DIR": "./bad_output",
+        "LOG_DIR": "./input",
+        "SKETCH_ACCURACY": 0.01
+        }
+    result = create_report(config, 'nginx-access-ui.log-20100101')
+
+    assert result[0]['url'] == '/api/v2/banner/25019354'
+    for column in ('time_med', 'time_p90', 'time_p95', 'time_p99'):
+        assert abs(result[0][column] - 0.39) <= 0.39 * 0.01
+    assert 'sketch' not in result[0]
+
+
+@pytest.mark.usefixtures('workdir')
+def test_incremental_report_creator():
+    """
+    Test that incremental mode parses only lines appended after checkpoint
+    """
+    source = f'{os.path.dirname(__file__)}/input/nginx-access-ui.log-20100101'
+    with open(source, encoding='utf-8') as file:
+        first_line, second_line = file.read().splitlines(keepends=True)
+    config = {
+        "REPORT_SIZE": 1000,
+        "REPORT_DIR": "./output",
+        "LOG_DIR": "./input",
+        "INCREMENTAL": True
+        }
+    log_name = 'nginx-access-ui.log-20100102'
+    with open(f'input/{log_name}', 'w', encoding='utf-8') as log_file:
+        log_file.write(first_line + second_line[:20])
+
+    assert check_for_new_bytes(config, log_name)
+    result = create_report(config, log_name)
+    assert [row['url'] for row in result] == ['/api/v2/banner/25019354']
+    assert not check_for_new_bytes(config, log_name)
+
+    with open(f'input/{log_name}', 'a', encoding='utf-8') as log_file:
+        log_file.write(second_line[20:] + '\n' + first_line)
+    assert check_for_new_bytes(config, log_name)
+    result = create_report(config, log_name)
+    assert [row['count'] for row in result] == [2, 1]
+    assert load_checkpoint(config, log_name)['offset'] == \
+        os.path.getsize(f'input/{log_name}')
+
+
+@pytest.mark.usefixtures('workdir')
+def test_backfill():
+    """
+    Test that backfill creates reports only for logs without reports
+    """
+    source_dir = os.path.dirname(__file__)
+    for day in ('20100101', '20100102', '20100103'):
+        shutil.copy(f'{source_dir}/input/nginx-access-ui.log-20100101',
+                    f'input/nginx-access-ui.log-{day}')
+    shutil.copy('jquery/report.html', 'output/report-2010.01.02.html')
+    config = {
+        "REPORT_SIZE": 1000,
+        "REPORT_DIR": "./output",
+        "LOG_DIR": "./input",
+        "BACKFILL_WORKERS": 2
+        }
+
+    created = backfill(config, check_for_logs(config),
+                       check_for_reports(config))
+
+    assert sorted(created) == ['report-2010.01.01', 'report-2010.01.03']
+    with open('output/report-2010.01.03.html', encoding='utf-8') as report:
+        assert '/api/v2/banner/25019354' in report.read()
+
+
+@pytest.mark.usefixtures('workdir')
+def test_backfill_skips_failed_log(monkeypatch):
+    """
+    Test that backfill logs and skips a log that fails with any exception
+    """
+    source_dir = os.path.dirname(__file__)
+    for day in ('20100101', '20100102'):
+        shutil.copy(f'{source_dir}/input/nginx-access-ui.log-20100101',
+                    f'input/nginx-access-ui.log-{day}')
+    analyze = log_analyzer.analyze_log
+
+    def analyze_or_fail(job_config, log_date, log_file):
+        if log_date == date(2010, 1, 1):
+            raise ValueError('broken log')
+        return analyze(job_config, log_date, log_file)
+
+    # Pool workers are forked, so they see the patched function
+    monkeypatch.setattr(log_analyzer, 'analyze_log', analyze_or_fail)
+    config = {
+        "REPORT_SIZE": 1000,
+        "REPORT_DIR": "./output",
+        "LOG_DIR": "./input",
+        "BACKFILL_WORKERS": 2
+        }
+
+    assert backfill(config, check_for_logs(config), {}) == \
+        ['report-2010.01.02']
+
+
+def test_url_store_top_k():
+    """
+    Test that heap top-k selects the same rows as a full sort
+    """
+    store = UrlStore()
+    for number in range(2000):
+        store.add(store.get_index(f'/url/{number % 700}'),
+                  (number * 7919 % 1000) / 1000)
+
+    expected = sorted(range(len(store)), key=store.time_sum.__getitem__,
+                      reverse=True)
+    assert store.top_k(50) == expected[:50]
+    assert store.top_k(5000) == expected
+
+
+def test_url_normalization():
+    """
+    Test that URL_RULES collapse urls into route templates
+    """
+    config = {
+        "REPORT_SIZE": 1000,
+        "URL_RULES": [["\\?.*$", ""], ["/\\d+", "/{id}"]],
+        "URL_CACHE_SIZE": 2
+        }
+    source = f'{os.path.dirname(__file__)}/input/nginx-access-ui.log-20100101'
+    with open(source, 'rb') as file:
+        line = file.readline()
+    lines = [line.replace(b'25019354', str(number).encode() + b'?q=1')
+             for number in range(10)]
+
+    aggregate = aggregate_blocks([lines], new_aggregate(config))
+    assert list(aggregate['results']) == ['/api/v2/banner/{id}']
+    assert aggregate['results'].count[0] == 10
+
+
+def test_gzip_backends(tmp_path):
+    """
+    Test that every available gzip backend returns the same lines
+    """
+    log_path = tmp_path / 'nginx-access-ui.log-20100102.gz'
+    lines = [f'line {i}'.encode() * (i % 7 + 1) for i in range(5000)]
+    with gzip.open(log_path, 'wb') as log_file:
+        log_file.write(b'\n'.join(lines) + b'\n')
+
+    backends = ['gzip', 'thread'] + [name for name, command
+                                     in GZIP_COMMANDS.items()
+                                     if shutil.which(command[0])]
+    for backend in backends:
+        assert [line for block in read_gzip(str(log_path), backend)
+                for line in block] == lines, backend
+
+
+def test_gzip_thread_early_close(tmp_path):
+    """
+    Test that threaded gzip reader stops when consumer closes it while
+    reader thread waits on full queue to put end of file
+    """
+    log_path = tmp_path / 'nginx-access-ui.log-20100102.gz'
+    with gzip.open(log_path, 'wb') as log_file:
+        log_file.write((b'x' * 1023 + b'\n') * (GZIP_QUEUE_SIZE + 1))
+    blocks = iter_gzip_raw_blocks(str(log_path), 'thread', block_size=1024)
+    next(blocks)
+    time.sleep(0.5)
+    closer = threading.Thread(target=blocks.close, daemon=True)
+    closer.start()
+    closer.join(timeout=5)
+    assert not closer.is_alive()
+
+
+def test_report_creator_numpy():
+    """
+    Test that numpy aggregation backend gives the same report
+    """
+    pytest.importorskip('numpy')
+    config = {
+        "REPORT_SIZE": 1000,
+        "REPORT_DIR": "./bad_output",
+        "LOG_DIR": "./input"
+        }
+    expected = create_report(config, 'nginx-access-ui.log-20100101')
+    config['AGGREGATION_BACKEND'] = 'numpy'
+
+    assert create_report(config, 'nginx-access-ui.log-20100101') == expected
+
+
+def test_log_generator():
+    """
+    Test that generated log is parsed except for malformed share
+    """
+    lines = list(generate_lines(2000, urls=50, malformed=0.1, seed=1))
+    aggregate = aggregate_lines(lines, new_aggregate())
+
+    assert len(lines) == 2000
+    assert len(aggregate['results']) <= 50
+    assert 100 < aggregate['bad_reqs'] < 300
+    assert sum(aggregate['results'].count) + aggregate['bad_reqs'] == 2000
+
+
+@pytest.mark.usefixtures('workdir')
+def test_run_metrics():
+    """
+    Test that metrics file is written next to report
+    """
+    source_dir = os.path.dirname(__file__)
+    shutil.copy(f'{source_dir}/input/nginx-access-ui.log-20100101',
+                'input/nginx-access-ui.log-20100101')
+    config = {
+        "REPORT_SIZE": 1000,
+        "REPORT_DIR": "./output",
+        "LOG_DIR": "./input",
+        "PROMETHEUS_TEXTFILE": "log_analyzer.prom"
+        }
+    reset_metrics()
+    analyze_log(config, max(check_for_logs(config)),
+                'nginx-access-ui.log-20100101')
+
+    with open('output/metrics-2010.01.01.json', encoding='utf-8') as file:
+        metrics = json.load(file)
+    assert metrics['counters']['lines_read'] == 2
+    assert metrics['counters']['distinct_urls'] == 2
+    assert metrics['counters']['bad_lines'] == 0
+    for name in ('check_for_logs', 'create_report', 'aggregate', 'top_k',
+                 'create_and_copy_report'):
+        assert name in metrics['stages']
+    with open('log_analyzer.prom', encoding='utf-8') as file:
+        assert 'log_analyzer_lines_read{log="nginx-access-ui.log-20100101",' \
+               'report="report-2010.01.01"} 2' in file.read()
+    assert check_for_reports(config).keys() == check_for_logs(config).keys()
+
+
+def test_bad_lines_early_abort(tmp_path):
+    """
+    Test that parsing of broken log stops after first blocks and sample
+    """
+    read_blocks = []
+
+    def blocks():
+        for _ in range(100):
+            read_blocks.append(1)
+            yield [b'not a log line'] * 100
+
+    assert not bad_lines_exceeded(3, 5, 0.5, 3.09)
+    assert bad_lines_exceeded(60, 100, 0.1, 3.09)
+    with pytest.raises(FileNotFoundError):
+        aggregate_blocks(blocks(), new_aggregate())
+    assert len(read_blocks) == 1
+
+    log_path = tmp_path / 'nginx-access-ui.log-20100101'
+    log_path.write_bytes(b'not a log line\n' * 1000)
+    for mode in ('prefix', 'random'):
+        with pytest.raises(FileNotFoundError):
+            validate_sample({'BAD_LINES_SAMPLE': 100,
+                             'BAD_LINES_SAMPLE_MODE': mode}, str(log_path))
+    aggregate = new_aggregate()
+    aggregate['lines'], aggregate['bad_reqs'] = 10, 4
+    aggregate['total_time'] = 1.0
+    aggregate['results'].add(aggregate['results'].get_index('/'), 1.0)
+    assert len(build_first_k({'REPORT_SIZE': 10}, aggregate)) == 1
+
+
+def test_bad_line_examples(caplog):
+    """
+    Test that only first examples of bad lines are kept, the rest counted,
+    and examples are logged once after shards are merged
+    """
+    lines = [b'', b'1.1.1.1 - - [29/Jun/2017:03:50:22 +0300] "GET /x'] * 50
+    config = {'BAD_LINES_EXAMPLES': 3, 'BAD_LINES_THRESHOLD': 1}
+    aggregate = aggregate_lines(lines, new_aggregate(config))
+    merge_aggregates(aggregate, aggregate_lines(lines, new_aggregate(config)))
+    log_bad_lines_summary(aggregate)
+
+    messages = [record.getMessage() for record in caplog.records]
+    assert len([message for message in messages
+                if message.startswith('Bad line')]) == 6
+    assert '100 bad lines (empty), 97 of them not logged' in messages
+
+    assert bad_line_category(b'  ') == 'empty'
+    assert aggregate['bad_reqs'] == 200
+    assert aggregate['bad_categories'] == {'empty': 100, 'truncated': 100}
+    assert [len(examples) for examples in aggregate['bad_examples'].values()] \
+        == [3, 3]
+
+
+@pytest.mark.usefixtures('workdir')
+def test_rollup():
+    """
+    Test that week rollup merges stored aggregates of every analyzed day
+    """
+    source_dir = os.path.dirname(__file__)
+    for day in ('20100101', '20100102', '20100103'):
+        shutil.copy(f'{source_dir}/input/nginx-access-ui.log-20100101',
+                    f'input/nginx-access-ui.log-{day}')
+    config = {
+        "REPORT_SIZE": 1000,
+        "REPORT_DIR": "./output",
+        "LOG_DIR": "./input",
+        "SKETCH_ACCURACY": 0.01,
+        "PERSIST_AGGREGATES": True
+        }
+    for log_date, log_file in check_for_logs(config).items():
+        analyze_log(config, log_date, log_file)
+    aggregates = check_for_aggregates(config)
+    os.remove('input/nginx-access-ui.log-20100102')
+
+    assert len(aggregates) == 3
+    assert rollup(config, 'week', max(aggregates)) == \
+        'rollup-week-2009.12.28'
+    assert rollup(config, 'month', max(aggregates)) == \
+        'rollup-month-2010.01.01'
+    for filename in ('rollup-week-2009.12.28', 'rollup-month-2010.01.01'):
+        with open(f'output/{filename}.html', encoding='utf-8') as report:
+            assert '"count": 3' in report.read()
+    assert check_for_reports(config).keys() == aggregates.keys()
+
+
+@pytest.mark.usefixtures('workdir')
+def test_time_buckets():
+    """
+    Test that time buckets of log are saved and queried by time range
+    """
+    lines = list(generate_lines(3000, urls=20, seed=2))
+    with open('input/nginx-access-ui.log-20170630', 'w',
+              encoding='utf-8') as log_file:
+        log_file.write(''.join(lines))
+    config = {
+        "REPORT_SIZE": 10,
+        "REPORT_DIR": "./output",
+        "LOG_DIR": "./input",
+        "BUCKET_MINUTES": 60,
+        "WORKERS": 2
+        }
+    create_report(config, 'nginx-access-ui.log-20170630', date(2017, 6, 30))
+    expected = new_aggregate()
+    for line in lines:
+        if line.split('[')[1][11:15] == ':14:':
+            aggregate_lines([line], expected)
+
+    rows = query_buckets(config, date(2017, 6, 30), (14 * 60, 15 * 60),
+                         limit=1000)
+    assert sum(row['count'] for row in rows) == \
+        sum(expected['results'].count)
+    assert rows[0]['time_sum'] == pytest.approx(
+        max(expected['results'].time_sum))
+    assert rows[0]['max_bucket_p99'] <= rows[0]['time_max']
+    url_rows = query_buckets(config, date(2017, 6, 30), (0, 24 * 60),
+                             url=rows[0]['url'])
+    assert [row['minute'] for row in url_rows] == \
+        sorted(row['minute'] for row in url_rows)
+    assert all(row['minute'] % 60 == 0 for row in url_rows)
+
+
+@pytest.mark.usefixtures('workdir')
+def test_time_index_range():
+    """
+    Test that time range of plain and multi-member gzip log is read
+    through time index with the same lines as a full scan
+    """
+    lines = [line.encode('utf-8')
+             for line in generate_lines(5000, urls=20, seed=3)]
+    with open('input/nginx-access-ui.log-20170630', 'wb') as log_file:
+        log_file.write(b''.join(lines))
+    with open('input/nginx-access-ui.log-20170701.gz', 'wb') as log_file:
+        log_file.write(gzip.compress(b''.join(lines[:2222])))
+        log_file.write(gzip.compress(b''.join(lines[2222:])))
+    config = {"REPORT_DIR": "./output", "LOG_DIR": "./input"}
+    start, end = datetime(2017, 6, 29, 14, 0), datetime(2017, 6, 29, 14, 10)
+    expected = [line.rstrip(b'\n') for line in lines
+                if b'29/Jun/2017:14:0' in line]
+
+    for log_name in ('nginx-access-ui.log-20170630',
+                     'nginx-access-ui.log-20170701.gz'):
+        for _ in range(2):
+            selected = [line for block in read_time_range(
+                config, log_name, start, end) for line in block]
+            assert selected == expected
+        assert os.path.exists(f'output/.timeindex-{log_name}.json')
+
+
+def test_log_tail(tmp_path):
+    """
+    Test that only new complete lines are read, also after rotation
+    """
+    log_path = tmp_path / 'access.log'
+    log_path.write_bytes(b'a\nb\nc')
+    tail = LogTail(str(log_path))
+
+    assert list(tail.read_blocks()) == [[b'a', b'b']]
+    with open(log_path, 'ab') as log_file:
+        log_file.write(b'd\ne\n')
+    assert list(tail.read_blocks()) == [[b'cd', b'e']]
+    assert not list(tail.read_blocks())
+    with open(log_path, 'ab') as log_file:
+        log_file.write(b'f\n')
+    os.rename(log_path, tmp_path / 'access.log.1')
+    log_path.write_bytes(b'g\n')
+    assert list(tail.read_blocks()) == [[b'f'], [b'g']]
+    log_path.write_bytes(b'')
+    assert not list(tail.read_blocks())
+    log_path.write_bytes(b'h\n')
+    assert list(tail.read_blocks()) == [[b'h']]
+    tail.close()
+
+
+@pytest.mark.usefixtures('workdir')
+def test_watch(monkeypatch):
+    """
+    Test that watch mode renders report of lines appended while it runs
+    """
+    source_dir = os.path.dirname(__file__)
+    with open(f'{source_dir}/input/nginx-access-ui.log-20100101',
+              encoding='utf-8') as log_file:
+        lines = log_file.readlines()
+    with open('input/nginx-access-ui.log-20100101', 'w',
+              encoding='utf-8') as log_file:
+        log_file.write(lines[0])
+    polls = []
+
+    def sleep(_):
+        polls.append(1)
+        if len(polls) == 3:
+            raise KeyboardInterrupt
+        with open('input/nginx-access-ui.log-20100101', 'a',
+                  encoding='utf-8') as appended:
+            appended.write(lines[0])
+
+    monkeypatch.setattr(log_analyzer.time, 'sleep', sleep)
+    config = {
+        "REPORT_SIZE": 1000,
+        "REPORT_DIR": "./output",
+        "LOG_DIR": "./input",
+        "WATCH_INTERVAL": 0,
+        "INCREMENTAL": True
+        }
+    with pytest.raises(KeyboardInterrupt):
+        log_analyzer.watch(config)
+
+    with open('output/report-2010.01.01.html', encoding='utf-8') as report:
+        assert '"count": 3' in report.read()
+    assert load_checkpoint(config, 'nginx-access-ui.log-20100101')[
+        'aggregate']['lines'] == 3
+
+
+@pytest.mark.usefixtures('workdir')
+def test_watch_checkpoint_checks_bad_lines(monkeypatch):
+    """
+    Test that checkpoint of watch mode keeps bad lines threshold of config,
+    so incremental run on a broken log aborts
+    """
+    source_dir = os.path.dirname(__file__)
+    shutil.copy(f'{source_dir}/input/nginx-access-ui.log-20100101',
+                'input/nginx-access-ui.log-20100101')
+
+    def sleep(_):
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr(log_analyzer.time, 'sleep', sleep)
+    config = {
+        "REPORT_SIZE": 1000,
+        "REPORT_DIR": "./output",
+        "LOG_DIR": "./input",
+        "WATCH_INTERVAL": 0,
+        "INCREMENTAL": True
+        }
+    with pytest.raises(KeyboardInterrupt):
+        log_analyzer.watch(config)
+    assert load_checkpoint(config, 'nginx-access-ui.log-20100101')[
+        'aggregate']['bad_threshold'] == 0.5
+
+    with open('input/nginx-access-ui.log-20100101', 'a',
+              encoding='utf-8') as log_file:
+        log_file.write('not a log line\n' * 100000)
+    with pytest.raises(FileNotFoundError):
+        create_report(config, 'nginx-access-ui.log-20100101')
+
+
+@pytest.mark.usefixtures('workdir')
+def test_report_chunks():
+    """
+    Test that report keeps first rows as JSON and the rest in gzip chunks
+    """
+    rows = [{'url': f'/api/{number}', 'count': number}
+            for number in range(25)]
+    config = {"REPORT_DIR": "./output", "REPORT_CHUNK_ROWS": 10}
+    create_and_copy_report('report-2010.01.01', config, rows)
+
+    with open('output/report-2010.01.01.html', encoding='utf-8') as report:
+        html = report.read()
+    inline = json.loads(html.split('var table = ')[1].split(';\n')[0])
+    chunks = json.loads(html.split('var chunks = ')[1].split(';\n')[0])
+    assert inline == rows[:10]
+    assert chunks == ['chunks-report-2010.01.01/00001.json.gz',
+                      'chunks-report-2010.01.01/00002.json.gz']
+    loaded = []
+    for chunk in chunks:
+        with gzip.open(f'output/{chunk}', 'rt', encoding='utf-8') as file:
+            loaded.extend(json.load(file))
+    assert loaded == rows[10:]
+    create_and_copy_report('report-2010.01.01', config, rows[:5])
+    assert not os.path.exists('output/chunks-report-2010.01.01')
+    assert list(check_for_reports(config).values()) == \
+        ['report-2010.01.01.html']
+
+
+@pytest.mark.usefixtures('workdir')
+def test_report_escapes_script():
+    """
+    Test that url from log can not close inline script of report
+    """
+    url = '/x</script><script>alert(1)</script>'
+    create_and_copy_report('report-2010.01.01', {"REPORT_DIR": "./output"},
+                           [{'url': url, 'count': 1}])
+
+    with open('output/report-2010.01.01.html', encoding='utf-8') as report:
+        html = report.read()
+    assert '<script>alert(1)' not in html
+    inline = json.loads(html.split('var table = ')[1].split(';\n')[0])
+    assert inline == [{'url': url, 'count': 1}]
+
+
+@pytest.mark.usefixtures('workdir')
+def test_spill_report_creator(tmp_path):
+    """
+    Test that report with url rows spilled to disk and its parsed lines
+    count are the same
+    """
+    with open('input/nginx-access-ui.log-20170630', 'w',
+              encoding='utf-8') as log_file:
+        log_file.writelines(generate_lines(5000, urls=500, seed=4))
+    config = {
+        "REPORT_SIZE": 20,
+        "REPORT_DIR": "./output",
+        "LOG_DIR": "./input"
+        }
+    expected = create_report(config, 'nginx-access-ui.log-20170630')
+    lines_parsed = get_metrics()['counters']['lines_parsed']
+    reset_metrics()
+    for workers in (1, 2):
+        spill_config = dict(config, SPILL_URLS=50, SPILL_PARTITIONS=4,
+                            SPILL_DIR=str(tmp_path), WORKERS=workers)
+        report = create_report(spill_config, 'nginx-access-ui.log-20170630')
+        assert get_metrics()['counters']['lines_parsed'] == lines_parsed
+        assert [row['url'] for row in report] == \
+            [row['url'] for row in expected]
+        for row, expected_row in zip(report, expected):
+            assert row == pytest.approx(expected_row)
+    assert get_metrics()['counters']['spilled_urls'] > 50
+    assert not [name for name in os.listdir(tmp_path)
+                if name.startswith('log_analyzer-spill-')]
+
+
+@pytest.mark.usefixtures('workdir')
+def test_spill_rollup(tmp_path):
+    """
+    Test that spilled days are persisted with every url, rollup of them
+    is the same as without spilling, and cut aggregates sum distinct urls
+    """
+    for day, seed in (('20170630', 6), ('20170701', 7)):
+        with open(f'input/nginx-access-ui.log-{day}', 'w',
+                  encoding='utf-8') as log_file:
+            log_file.writelines(generate_lines(3000, urls=300, seed=seed))
+    dates = [date(2017, 6, 30), date(2017, 7, 1)]
+    reports = []
+    for spill_urls in (None, 50):
+        config = {
+            "REPORT_SIZE": 10,
+            "REPORT_DIR": f"./output-{spill_urls}",
+            "LOG_DIR": "./input",
+            "PERSIST_AGGREGATES": True,
+            "SPILL_URLS": spill_urls,
+            "SPILL_PARTITIONS": 4,
+            "SPILL_DIR": str(tmp_path)
+            }
+        os.mkdir(config['REPORT_DIR'])
+        for log_date in dates:
+            create_report(config, f'nginx-access-ui.log-{log_date:%Y%m%d}',
+                          log_date)
+        reports.append(create_rollup_report(config, dates))
+    assert len(reports[1]) == 10
+    for row, expected_row in zip(reports[1], reports[0]):
+        assert row == pytest.approx(expected_row)
+
+    first, second = new_aggregate(), new_aggregate()
+    first['distinct_urls'], second['distinct_urls'] = 120, 80
+    assert merge_aggregates(first, second)['distinct_urls'] == 200
+
+
+def test_unique_clients():
+    """
+    Test that HyperLogLog counts are close and mergeable, and report gets
+    unique_clients column
+    """
+    first, second = HyperLogLog(14), HyperLogLog(14)
+    for number in range(20000):
+        first.add(client_hash(f'10.0.{number}'.encode()))
+        second.add(client_hash(f'10.0.{number + 10000}'.encode()))
+    assert abs(first.count() - 20000) < 20000 * 0.05
+    assert abs(first.merge(second).count() - 30000) < 30000 * 0.05
+    assert HyperLogLog(4).count() == 0
+
+    lines = [line.encode('utf-8')
+             for line in generate_lines(3000, urls=10, seed=5)]
+    aggregate = aggregate_blocks([lines[:1500]], new_aggregate(
+        {'UNIQUE_CLIENTS_PRECISION': 10}))
+    merge_aggregates(aggregate, aggregate_blocks(
+        [lines[1500:]], new_aggregate({'UNIQUE_CLIENTS_PRECISION': 10})))
+    clients = {}
+    for line in lines:
+        data = line_format_bytes.search(line)
+        if data:
+            clients.setdefault(data.group('req_uri').decode(), set()).add(
+                data.group('remote_addr'))
+    for row in build_first_k({'REPORT_SIZE': 10}, aggregate).values():
+        expected = len(clients[row['url']])
+        assert abs(row['unique_clients'] - expected) <= expected * 0.1 + 2
+
+
+def test_no_new_logs_startup(tmp_path):
+    """
+    Test that run without new logs imports no heavy modules, stays in
+    import time budget and does not touch log file
+    """
+    source_dir = os.path.dirname(__file__)
+    for directory in ('input', 'output', 'log'):
+        os.mkdir(tmp_path / directory)
+    shutil.copy(f'{source_dir}/input/nginx-access-ui.log-20100101',
+                tmp_path / 'input/nginx-access-ui.log-20100101')
+    (tmp_path / 'output/report-2010.01.01.html').write_text('')
+    (tmp_path / 'config.json').write_text(json.dumps(
+        {"REPORT_DIR": "./output", "LOG_DIR": "./input"}))
+    root = os.path.abspath(f'{source_dir}/../..')
+
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-m',
+         'dz1.log_analyzer.log_analyzer', '-c', 'config.json'],
+        cwd=tmp_path, env=dict(os.environ, PYTHONPATH=root),
+        capture_output=True, text=True, check=False)
+
+    lines = result.stderr.splitlines()
+    assert 'No new logs to analyze' in lines[-1]
+    imports = [line.split('|') for line in lines
+               if line.startswith('import time:') and 'cumulative' not in line]
+    names = [name.strip() for _, _, name in imports]
+    for module in ('numpy', 'sqlite3', 'concurrent.futures',
+                   'multiprocessing', 'logging.handlers',
+                   'dz1.log_analyzer.report_creator'):
+        assert module not in names
+    # Top level entries from the package on, interpreter startup excluded
+    first = next(number for number, name in enumerate(names)
+                 if name.startswith('dz1'))
+    total = sum(int(cumulative) for _, cumulative, name in imports[first:]
+                if not name.startswith('  '))
+    assert total < STARTUP_IMPORT_BUDGET_US
+    assert not os.path.exists(tmp_path / 'log/autotest.log')
@@ -12,6 +12,8 @@ import datetime
 import hashlib
 import json
 import logging
+import queue
+import threading
 import uuid
 from http.server import HTTPServer, BaseHTTPRequestHandler
 
@@ -33,12 +35,14 @@ FORBIDDEN = 403
 NOT_FOUND = 404
 INVALID_REQUEST = 422
 INTERNAL_ERROR = 500
+SERVICE_UNAVAILABLE = 503
 ERRORS = {
     BAD_REQUEST: "Bad Request",
     FORBIDDEN: "Forbidden",
     NOT_FOUND: "Not Found",
     INVALID_REQUEST: "Invalid Request",
     INTERNAL_ERROR: "Internal Server Error",
+    SERVICE_UNAVAILABLE: "Service Unavailable",
     }
 UNKNOWN = 0
 MALE = 1
@@ -48,6 +52,10 @@ GENDERS = {
     MALE: "male",
     FEMALE: "female",
     }
+WORKERS = 8
+QUEUE_SIZE = 64
+
+_thread_stores = threading.local()
 
 
 class BasicClassRequest(metaclass=DeclarativeFieldsMetaclass):
@@ -254,14 +262,37 @@ def method_handler(request, ctx, store):
     return "Unknown error is in request", INVALID_REQUEST
 
 
+def get_thread_store(store_class, db_type):
+    """
+    Returns store of the calling thread, created on first call, so store
+    and cache connections are never shared between server workers
+    """
+    stores = getattr(_thread_stores, 'stores', None)
+    if stores is None:
+        stores = _thread_stores.stores = {}
+    key = (store_class, db_type)
+    if key not in stores:
+        stores[key] = store_class(db_type)
+    return stores[key]
+
+
 class MainHTTPHandler(BaseHTTPRequestHandler):
     """
     Main HTTP handler class with builtin router
+    Store is created per thread of class store_class with db_type
     """
     router = {
         "method": method_handler
         }
-    store = Store('sql')
+    store_class = Store
+    db_type = 'sql'
+
+    @property
+    def store(self):
+        """
+        Store of the thread that handles request
+        """
+        return get_thread_store(self.store_class, self.db_type)
 
     @staticmethod
     def get_request_id(headers):
@@ -318,22 +349,110 @@ class MainHTTPHandler(BaseHTTPRequestHandler):
         self.wfile.write(output.encode('utf-8'))
 
 
+class ThreadPoolHTTPServer(HTTPServer):
+    """
+    HTTPServer that handles requests in a fixed pool of worker threads
+    Accepted connections wait for a worker in a queue of queue_size,
+    connection accepted when the queue is full gets 503 at once instead
+    of waiting behind requests that will not be served in time
+    """
+
+    def __init__(self, server_address, handler_class, workers=WORKERS,
+                 queue_size=QUEUE_SIZE):
+        """
+        Starts workers and binds server, listen backlog is queue_size too
+        """
+        self.request_queue_size = queue_size
+        self.requests = queue.Queue(maxsize=queue_size)
+        self.workers = [threading.Thread(target=self.serve_worker,
+                                         name=f'api-worker-{number}',
+                                         daemon=True)
+                        for number in range(workers)]
+        super().__init__(server_address, handler_class)
+        for worker in self.workers:
+            worker.start()
+
+    def process_request(self, request, client_address):
+        """
+        Passes accepted connection to workers, rejects it if queue is full
+        """
+        try:
+            self.requests.put_nowait((request, client_address))
+        except queue.Full:
+            logging.warning("Request queue is full, rejecting %s",
+                            client_address)
+            self.reject_request(request)
+
+    def serve_worker(self):
+        """
+        Worker loop, handles queued connections until None is queued
+        """
+        while True:
+            item = self.requests.get()
+            if item is None:
+                return
+            request, client_address = item
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+    def reject_request(self, request):
+        """
+        Writes 503 response to connection without reading request and
+        closes it
+        """
+        body = json.dumps({"error": ERRORS[SERVICE_UNAVAILABLE],
+                           "code": SERVICE_UNAVAILABLE}).encode('utf-8')
+        try:
+            request.sendall(b'HTTP/1.0 503 Service Unavailable\r\n'
+                            b'Content-Type: application/json\r\n'
+                            b'Content-Length: %d\r\n\r\n' % len(body)
+                            + body)
+        except OSError:
+            pass
+        self.shutdown_request(request)
+
+    def server_close(self):
+        """
+        Closes socket and stops workers after queued requests are handled
+        """
+        super().server_close()
+        for _ in self.workers:
+            self.requests.put(None)
+        for worker in self.workers:
+            worker.join()
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
         prog='Online Score APP (OSA)',
         description='Validates fields from post request',
         epilog='Some help text')
-    parser.add_argument('-c', '--port', default=8080)
+    parser.add_argument('-c', '--port', type=int, default=8080)
     parser.add_argument('-l', '--log', default='common.log')
     parser.add_argument('-db', '--database', default='sql')
-    log_name = None if not parser.parse_args().log else parser.parse_args().log
-    logging.basicConfig(filename=parser.parse_args().log,
+    parser.add_argument('-w', '--workers', type=int, default=WORKERS,
+                        help='Number of worker threads, 0 serves requests '
+                             'one by one in the main thread')
+    parser.add_argument('-q', '--queue-size', type=int, default=QUEUE_SIZE,
+                        help='Number of accepted requests waiting for '
+                             'a worker, the rest get 503')
+    args = parser.parse_args()
+    logging.basicConfig(filename=args.log,
                         level=logging.INFO,
                         format='[%(asctime)s] %(levelname).1s %(message)s',
                         datefmt='%Y.%m.%d %H:%M:%S')
-    server = HTTPServer(("localhost", parser.parse_args().port),
-                        MainHTTPHandler)
-    logging.info("Starting server at %s", parser.parse_args().port)
+    MainHTTPHandler.db_type = args.database
+    if args.workers > 0:
+        server = ThreadPoolHTTPServer(("localhost", args.port),
+                                      MainHTTPHandler, args.workers,
+                                      args.queue_size)
+    else:
+        server = HTTPServer(("localhost", args.port), MainHTTPHandler)
+    logging.info("Starting server at %s", args.port)
     try:
         server.serve_forever()
     except KeyboardInterrupt:
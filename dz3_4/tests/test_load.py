@@ -0,0 +1,148 @@
+# pylint:disable=missing-function-docstring
+# pylint:disable=duplicate-code
+"""
+Load test of scoring api servers
+Starts single-threaded HTTPServer and ThreadPoolHTTPServer on free ports
+with a store that answers after STORE_DELAY and prints requests/sec and
+p99 latency at 1, 8 and 64 concurrent clients
+The benchmark takes about 15 s and compares wall-clock throughput, so it
+only runs with LOAD_TEST=1, e.g. LOAD_TEST=1 pytest -s tests/test_load.py
+"""
+
+import hashlib
+import http.client
+import json
+import os
+import threading
+import time
+from http.server import HTTPServer
+
+import pytest
+
+from dz3_4.api_handler.api import (SALT, MainHTTPHandler, OK,
+                                   ThreadPoolHTTPServer)
+from dz3_4.api_handler.store import Store
+
+STORE_DELAY = 0.01
+REQUESTS = 128
+CLIENTS = (1, 8, 64)
+REQUEST = {"account": "horns&hoofs", "login": "hf",
+           "method": "online_score",
+           "token": hashlib.sha512(
+               ("horns&hoofs" + "hf" + SALT).encode('utf-8')).hexdigest(),
+           "arguments": {"phone": "79175002040", "email": "stupnikov@otus.ru",
+                         "first_name": "Stanislav", "last_name": "Stupnikov",
+                         "birthday": "01.01.1990", "gender": 1}}
+
+
+class SlowStore(Store):
+    """
+    Store without database that spends STORE_DELAY on every cache call
+    """
+
+    def cache_get(self, key):
+        time.sleep(STORE_DELAY)
+
+    def cache_set(self, key, score, timeout=60 * 60):
+        time.sleep(STORE_DELAY)
+
+
+class SlowStoreHandler(MainHTTPHandler):
+    """
+    Handler with per-thread SlowStore and no request logging
+    """
+    store_class = SlowStore
+    db_type = 'debug'
+
+    def log_message(self, format, *args):  # pylint:disable=redefined-builtin
+        pass
+
+
+def run_clients(port, clients, requests=REQUESTS):
+    """
+    Sends requests split between client threads
+    Returns successful requests/sec, p99 latency in ms and list of
+    response codes, None for connections that failed
+    """
+    body = json.dumps(REQUEST)
+    latencies, codes = [], []
+    lock = threading.Lock()
+
+    def client():
+        for _ in range(requests // clients):
+            started = time.perf_counter()
+            connection = http.client.HTTPConnection('127.0.0.1', port,
+                                                    timeout=60)
+            try:
+                connection.request('POST', '/method/', body)
+                code = connection.getresponse().status
+            except OSError:
+                code = None
+            finally:
+                connection.close()
+            with lock:
+                latencies.append(time.perf_counter() - started)
+                codes.append(code)
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    p99 = latencies[max(0, int(len(latencies) * 0.99) - 1)]
+    return codes.count(OK) / elapsed, p99 * 1000, codes
+
+
+@pytest.fixture(name='servers')
+def fixture_servers():
+    servers = {
+        'single': HTTPServer(('127.0.0.1', 0), SlowStoreHandler),
+        'pool-8': ThreadPoolHTTPServer(('127.0.0.1', 0), SlowStoreHandler,
+                                       workers=8, queue_size=64),
+        }
+    threads = [threading.Thread(target=server.serve_forever, daemon=True)
+               for server in servers.values()]
+    for thread in threads:
+        thread.start()
+    yield servers
+    for server in servers.values():
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.mark.skipif(not os.environ.get('LOAD_TEST'),
+                    reason='benchmark, set LOAD_TEST=1 to run')
+def test_load(servers):
+    results = {}
+    print(f'\n{"server":>8} {"clients":>8} {"req/s":>8} {"p99 ms":>8} '
+          f'{"failed":>8}')
+    for name, server in servers.items():
+        for clients in CLIENTS:
+            rps, p99, codes = run_clients(server.server_address[1], clients)
+            results[name, clients] = rps
+            print(f'{name:>8} {clients:>8} {rps:>8.1f} {p99:>8.1f} '
+                  f'{len(codes) - codes.count(OK):>8}')
+            if name != 'single':
+                assert codes == [OK] * len(codes)
+    # Every request waits 2 * STORE_DELAY for store, a pool of 8 workers
+    # has to serve several of them at once
+    assert results['pool-8', 8] > 3 * results['single', 8]
+    assert results['pool-8', 64] > 3 * results['single', 64]
+
+
+def test_full_queue_rejects():
+    server = ThreadPoolHTTPServer(('127.0.0.1', 0), SlowStoreHandler,
+                                  workers=1, queue_size=1)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        _, _, codes = run_clients(server.server_address[1], 16, 32)
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert OK in codes
+    assert 503 in codes
+    assert set(codes) - {OK} <= {503, None}